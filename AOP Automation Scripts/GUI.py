@@ -7,7 +7,7 @@ from PyQt5.QtWidgets import (
     QToolButton, QSpinBox, QFileDialog, QTabWidget, QTableWidget,
     QSplitter, QHeaderView, QTableWidgetItem
 )
-from PyQt5.QtCore import QDate, Qt, QSize, QDir
+from PyQt5.QtCore import QDate, Qt, QSize, QDir, QObject, QThread, pyqtSignal, pyqtSlot
 from PyQt5.QtGui import QFont, QTextCursor, QIcon, QColor
 
 import datetime
@@ -15,16 +15,149 @@ import time
 import random
 import subprocess
 import os 
-import json 
+import threading
+
+# SAP_File_Automation and remove_specified_rows pull in pandas, numpy and openpyxl, so they are
+# imported on first use (pipeline_modules) and the window comes up without waiting for them
+import keyword_config
+from progress import OperationCancelled
+from instrumentation import RunReport
+
+def pipeline_modules():
+    """
+    Imports (on first call) and returns the pipeline modules as (file_reader, trimmer).
+    """
+    import SAP_File_Automation as file_reader
+    import remove_specified_rows as trimmer
+    return file_reader, trimmer
+
+def preload_pipeline_modules():
+    """
+    Warms the pipeline imports on a background thread once the window is up, so the first Run doesn't pay for them.
+    """
+    threading.Thread(target=pipeline_modules, name="preload-pipeline", daemon=True).start()
+
+class TaskRunner(QObject):
+    """
+    Runs the selected tasks on a worker thread. Progress and log lines are sent to the window
+    through signals; cancel() stops the running step at its next progress report.
+    """
+    progress = pyqtSignal(str, int) # (task key, percent)
+    log = pyqtSignal(str, bool) # (html, end the line)
+    finished = pyqtSignal(bool) # True if cancelled
+
+    def __init__(self, selected_keys, input_path, output_dir, keep_converted):
+        super().__init__()
+        self.selected_keys = selected_keys
+        self.input_path = input_path
+        self.output_dir = output_dir
+        self.keep_converted = keep_converted
+        self._cancelled = False
+
+    def cancel(self):
+        self._cancelled = True
+
+    def _progress_for(self, *task_keys):
+        def callback(percent):
+            if self._cancelled:
+                raise OperationCancelled()
+            for task_key in task_keys:
+                self.progress.emit(task_key, percent)
+        return callback
+
+    @staticmethod
+    def _wrote_views(classification, views):
+        """True if a trim pass already wrote every sheet in views, so Configure Report can skip reopening the report."""
+        return bool(views) and classification is not None and set(views) <= set(classification.sheets_written)
+
+    @pyqtSlot()
+    def run(self):
+        report = RunReport(self.input_path)
+        try:
+            with report:
+                self._run_tasks()
+        except OperationCancelled:
+            self.log.emit('<b><font color = "red"> CANCELLED </font></b>', True)
+        except Exception as e:
+            self.log.emit(f'<b><font color = "red"> ERROR! {e} </font></b>', True)
+        finally:
+            self._log_run_report(report)
+            self.finished.emit(self._cancelled)
 
-import SAP_File_Automation as file_reader
-import remove_specified_rows as trimmer
+    def _log_run_report(self, report):
+        if not report.stages:
+            return
+        try:
+            report.write(os.path.join(self.output_dir, 'formatted_report.xlsx'))
+        except OSError as e:
+            print(f"Could not write run report: {e}")
+        self.log.emit('<b> Run summary </b>', True)
+        for line in report.summary():
+            self.log.emit(f'&nbsp;&nbsp;{line}', True)
+
+    def _run_tasks(self):
+        file_reader, trimmer = pipeline_modules()
+        # Highlight and Remove share one classification pass when both are selected
+        trim_both = 'highlight' in self.selected_keys and 'remove' in self.selected_keys
+        report_path = os.path.join(self.output_dir, 'formatted_report.xlsx')
+        # With Remove Rows, the summary sheets are written in its pass instead of reopening the report
+        views = trimmer.REPORT_VIEWS if 'configure' in self.selected_keys and 'remove' in self.selected_keys else None
+        views_written = False # Set once Remove Rows has written every sheet in views
+        converted_df = None
+        for task_key in self.selected_keys:
+            if self._cancelled:
+                raise OperationCancelled()
+            if task_key == 'convert':
+                self.log.emit(f'<b> Loading File {self.input_path} ... </b>', False)
+                # The converted sheet stays in memory; it is only spilled to disk for debugging
+                spill_path = os.path.join(self.output_dir, "temporary_file.xlsx") if self.keep_converted else None
+                converted_df = file_reader.convert_mhtml_to_dataframe(self.input_path, spill_excel_path=spill_path,
+                                                                      progress_callback=self._progress_for('convert'))
+                self.log.emit('<b><font color = "green"> DONE </font></b>', True)
+
+            if task_key == 'highlight' or task_key == 'remove':
+                if task_key == 'highlight': self.log.emit(f'<b> Highlighting Rows ... </b>', False)
+                if task_key == 'remove': self.log.emit(f'<b> Removing Rows ... </b>', False)
+                if converted_df is not None:
+                    if not trim_both:
+                        classification = trimmer.apply_conditional_formatting(
+                            converted_df, report_path, task=task_key, views=views if task_key == 'remove' else None,
+                            progress_callback=self._progress_for(task_key))
+                        if task_key == 'remove':
+                            views_written = self._wrote_views(classification, views)
+                    elif task_key == 'highlight': # Remove Rows output is written in the same pass
+                        classification = trimmer.apply_conditional_formatting(
+                            converted_df, report_path, task='both', views=views,
+                            progress_callback=self._progress_for('highlight', 'remove'))
+                        views_written = self._wrote_views(classification, views)
+                    self.log.emit('<b><font color = "green"> DONE </font></b>', True)
+                else:
+                    try:
+                        self.log.emit('<b><font color = "red"> FAILED </font></b>', True)
+                        self.log.emit('<b><font color = "blue"> Couldnt download using conventional methods. Switching to direct download... </font></b>', False)
+                        trimmer.apply_conditional_formatting(self.input_path, report_path, sheet_name = task_key,
+                                                             progress_callback=self._progress_for(task_key))
+                    except OperationCancelled:
+                        raise
+                    except Exception as e:
+                        self.log.emit('<b><font color = "red"> ERROR! Problem applying conditional Formatting </font></b>', False)
+
+            if task_key == 'configure':
+                # Summary sheets are cut from the rollup cube cached by Remove Rows
+                self.log.emit('<b> Configuring Report ... </b>', False)
+                if views_written or trimmer.configure_report(report_path, progress_callback=self._progress_for('configure')):
+                    self.log.emit('<b><font color = "green"> DONE </font></b>', True)
+                else:
+                    self.log.emit('<b><font color = "red"> FAILED </font></b>', True)
+
+            self.progress.emit(task_key, 100)
 
 class SearchApp(QWidget):
     def __init__(self):
         super().__init__()
         self.function_progress_bars = {}
         self.function_checkboxes = {} # Store checkboxes for easier access
+        self.task_runner = None # TaskRunner for the tasks currently running, if any
         self.icon_arrow_right = "►" # Placeholder for QIcon(QDir.currentPath() + "/icons/arrow_right.png")
         self.icon_arrow_down = "▼" # Placeholder for QIcon(QDir.currentPath() + "/icons/arrow_down.png")
         
@@ -153,6 +286,9 @@ class SearchApp(QWidget):
         self.open_on_finish = QCheckBox("Open on Finish")
         self.open_on_finish.setChecked(True) # Default to checked
         checkboxes_v_layout_exec.addWidget(self.open_on_finish)
+        self.cb_keep_converted = QCheckBox("Keep Converted File (debug)")
+        self.cb_keep_converted.setChecked(False) # Converted data is passed in memory by default
+        checkboxes_v_layout_exec.addWidget(self.cb_keep_converted)
         checkboxes_v_layout_exec.addStretch(1) # Push checkboxes up
 
         exec_controls_outer_h_layout.addLayout(checkboxes_v_layout_exec)
@@ -164,6 +300,12 @@ class SearchApp(QWidget):
         self.run_button.setMinimumWidth(200) # Ensure button has decent width
         exec_controls_outer_h_layout.addWidget(self.run_button, 0, Qt.AlignVCenter) # Align button vertically centered
 
+        self.cancel_button = QPushButton('Cancel')
+        self.cancel_button.clicked.connect(self.on_cancel_clicked)
+        self.cancel_button.setFixedHeight(35)
+        self.cancel_button.setEnabled(False) # Only while tasks are running
+        exec_controls_outer_h_layout.addWidget(self.cancel_button, 0, Qt.AlignVCenter)
+
         self.execution_controls_group.setLayout(exec_controls_outer_h_layout)
         main_layout.addWidget(self.execution_controls_group)
 
@@ -246,16 +388,17 @@ class SearchApp(QWidget):
         functions_av_group.addLayout(tables_hbox)
 
         # --- Add values to Tables ---
-        for name in trimmer.red_keywords_group:
+        keyword_groups = keyword_config.load_keyword_groups()
+        for name in keyword_groups['red']:
             self.add_table_row(self.remove_table, name, 0)
 
-        for name in trimmer.red_keywords_complex:
+        for name in keyword_groups['red_complex']:
             self.add_table_row(self.remove_table, name , 1)
         
-        for name in trimmer.green_keywords_group:
+        for name in keyword_groups['green']:
             self.add_table_row(self.keep_table, name, 0)
         
-        for name in trimmer.green_keywords_complex:
+        for name in keyword_groups['green_complex']:
             self.add_table_row(self.keep_table, name, 1)
 
 
@@ -325,12 +468,11 @@ class SearchApp(QWidget):
     def reset_table_values(self):
         self.keep_table.setRowCount(0)
         self.remove_table.setRowCount(0) 
-        with open("AOP Automation Scripts/input_data/keyword_groups_default.json", "r", encoding="utf-8") as f:
-            loaded = json.load(f)
-            red_keywords_group = loaded["red"]
-            red_keywords_complex = loaded["red_complex"]
-            green_keywords_group = loaded["green"]
-            green_keywords_complex = loaded["green_complex"]
+        loaded = keyword_config.load_keyword_groups(keyword_config.KEYWORD_GROUPS_DEFAULT_PATH)
+        red_keywords_group = loaded["red"]
+        red_keywords_complex = loaded["red_complex"]
+        green_keywords_group = loaded["green"]
+        green_keywords_complex = loaded["green_complex"]
 
         for name in red_keywords_group:
             self.add_table_row(self.remove_table, name, 0)
@@ -401,9 +543,7 @@ class SearchApp(QWidget):
             "green_complex": green_complex
         }
         try: 
-            with open("AOP Automation Scripts/input_data/keyword_groups.json", "w", encoding="utf-8") as f:
-                json.dump(keyword_dict, f, indent=2)
-                
+            keyword_config.save_keyword_groups(keyword_dict)
         except Exception as e:
             self.results_output.append("")
             self.results_output.insertHtml('<b><font color = "red"> ERROR! Could not download keyword_groups.json </font></b>')
@@ -483,7 +623,11 @@ class SearchApp(QWidget):
     def update_progress(self, function_key, percentage):
         if function_key in self.function_progress_bars:
             self.function_progress_bars[function_key].setValue(percentage)
-            QApplication.processEvents()
+
+    def append_log(self, html, end_line):
+        self.results_output.insertHtml(html)
+        if end_line:
+            self.results_output.append("")
 
     def on_run_clicked(self):
         is_build_files = self.cb_build_files.isChecked()
@@ -491,66 +635,37 @@ class SearchApp(QWidget):
 
         for pb in self.function_progress_bars.values(): pb.setValue(0)
 
-        selected_tasks = []
-        for key, checkbox in self.function_checkboxes.items():
-            if checkbox.isChecked():
-                selected_tasks.append((key, checkbox.text())) # (key, display_name)
-
-        if not selected_tasks:
+        selected_keys = [key for key, checkbox in self.function_checkboxes.items() if checkbox.isChecked()]
+        if not selected_keys:
             self.results_output.append("No tasks selected to run.")
             return
 
+        # The tasks run on a worker thread so the window stays responsive
+        self.task_thread = QThread(self)
+        self.task_runner = TaskRunner(selected_keys, self.download_in_input.text(), self.download_out_input.text(),
+                                      self.cb_keep_converted.isChecked())
+        self.task_runner.moveToThread(self.task_thread)
+        self.task_thread.started.connect(self.task_runner.run)
+        self.task_runner.progress.connect(self.update_progress)
+        self.task_runner.log.connect(self.append_log)
+        self.task_runner.finished.connect(self.on_run_finished)
+        self.task_runner.finished.connect(self.task_thread.quit)
+        self.task_thread.finished.connect(self.task_runner.deleteLater)
+        self.task_thread.finished.connect(self.task_thread.deleteLater)
+
         self.run_button.setEnabled(False)
-        try:
-            temp_path = None
-            for task_key, task_name_display in selected_tasks:
-                progress_callback_for_task = lambda p, tk=task_key: self.update_progress(tk, p)
-                if task_key == 'convert':
-                    self.results_output.insertHtml(f'<b> Loading File {self.download_in_input.text()} ... </b>')
-                    temp_path = os.path.join(self.download_out_input.text(), "temporary_file.xlsx")
-                    QApplication.processEvents()
-                    file_reader.convert_mhtml_to_excel(self.download_in_input.text(), temp_path)
-                    self.results_output.insertHtml('<b><font color = "green"> DONE </font></b>')
-                    self.results_output.append("")
-                    QApplication.processEvents()
-
-                if task_key == 'highlight' or task_key == 'remove':
-                    if task_key == 'highlight': self.results_output.insertHtml(f'<b> Highlighting Rows ... </b>')
-                    if task_key == 'remove': self.results_output.insertHtml(f'<b> Removing Rows ... </b>')
-                    QApplication.processEvents()  
-                    if temp_path:
-                        trimmer.apply_conditional_formatting(temp_path, os.path.join(self.download_out_input.text(), 'formatted_report.xlsx'), task=task_key)
-                        self.results_output.insertHtml('<b><font color = "green"> DONE </font></b>')
-                        self.results_output.append("")
-                        QApplication.processEvents()
-                    elif not temp_path:
-                        try:
-                            self.results_output.insertHtml('<b><font color = "red"> FAILED </font></b>')
-                            self.results_output.append("")
-                            self.results_output.insertHtml('<b><font color = "blue"> Couldnt download using conventional methods. Switching to direct download... </font></b>')
-                            QApplication.processEvents()
-                            trimmer.apply_conditional_formatting(self.download_in_input.text(), os.path.join(self.download_out_input.text(), 'formatted_report.xlsx'), sheet_name = task_key)
-                        except Exception as e:
-                            self.results_output.insertHtml('<b><font color = "red"> ERROR! Problem applying conditional Formatting </font></b>')
-                            QApplication.processEvents()          
-                    else:
-                        self.results_output.insertHtml('<b><font color = "red"> FAILED </font></b>')
-                        self.results_output.append("")
-                        self.results_output.insertHtml('<b><font color = "red"> ERROR! No File Path From File convert. Could not find file destination or lookup </font></b>')
-                        QApplication.processEvents()
-
-                    if task_key == 'remove':
-                        self.results_output.append("")
-                        self.results_output.insertHtml(f'<b> Deleting File {self.download_in_input.text()} ... </b>')
-                        QApplication.processEvents()
-                        if os.path.exists(temp_path):
-                            os.remove(temp_path)
-                            self.results_output.insertHtml('<b><font color = "red"> DONE </font></b>')
-                            QApplication.processEvents()
-                self.function_progress_bars[task_key].setValue(100)
+        self.cancel_button.setEnabled(True)
+        self.task_thread.start()
 
-        finally:
-            self.run_button.setEnabled(True)
+    def on_cancel_clicked(self):
+        if self.task_runner is not None:
+            self.cancel_button.setEnabled(False)
+            self.task_runner.cancel()
+
+    def on_run_finished(self, cancelled):
+        self.task_runner = None
+        self.run_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
 
     def apply_styles(self):
         MAIN_WINDOW_BACKGROUND = "#e0e7ef" # Slightly bluish gray
@@ -662,5 +777,6 @@ class SearchApp(QWidget):
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     ex = SearchApp()
+    preload_pipeline_modules()
     sys.exit(app.exec_())
 
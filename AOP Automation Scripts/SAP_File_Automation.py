@@ -1,14 +1,29 @@
 import pandas as pd
 import os
+import mmap
+import codecs
+import binascii
+import itertools
+import hashlib
+import math
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from email import message_from_bytes
 from email.parser import BytesParser
 from email.policy import default as default_policy
 import re # For more complex string cleaning
+import json
+import pickle
+import time
+from progress import OperationCancelled, report_progress, scaled_progress
+from instrumentation import stage
 
 # --- Configuration ---
 # Ensure these are installed:
 # pip install pandas lxml html5lib openpyxl (for .xlsx) xlwt (for .xls)
 
+HTML_CHUNK_SIZE = 1024 * 1024 # Bytes of encoded payload decoded per step when streaming
+
 def extract_html_from_mhtml(mhtml_file_path):
     """
     Extracts the primary HTML content from an MHTML file.
@@ -36,139 +51,815 @@ def extract_html_from_mhtml(mhtml_file_path):
         print(f"Error reading or parsing MHTML file '{mhtml_file_path}': {e}")
         return None
 
-def clean_and_convert_numeric(df):
+def _read_mime_headers(mm, offset):
     """
-    Attempts to clean and convert columns in a DataFrame to numeric types.
+    Reads a block of MIME headers starting at `offset` of a memory-mapped file.
+    Returns (headers, body_offset) where header names are lower-cased.
+    """
+    headers = {}
+    last_name = None
+    mm.seek(offset)
+    while True:
+        line = mm.readline()
+        if not line or not line.strip():
+            break
+        text = line.decode('latin-1').rstrip('\r\n')
+        if text[:1] in (' ', '\t') and last_name: # Folded continuation of the previous header
+            headers[last_name] += ' ' + text.strip()
+            continue
+        name, _, value = text.partition(':')
+        last_name = name.strip().lower()
+        headers[last_name] = value.strip()
+    return headers, mm.tell()
+
+def _header_param(header_value, param):
+    """
+    Returns a parameter (e.g. boundary, charset) from a Content-Type style header value.
     """
-    df_converted = df.copy()
-    for col in df_converted.columns:
-        # Attempt to convert only if the column is of object type (likely strings)
-        if df_converted[col].dtype == 'object':
+    match = re.search(r';\s*' + param + r'\s*=\s*(?:"([^"]*)"|([^\s;]+))', header_value or '', re.IGNORECASE)
+    if not match:
+        return None
+    return match.group(1) if match.group(1) is not None else match.group(2)
+
+def _find_html_part(mm):
+    """
+    Locates the text/html part of a memory-mapped MHTML file by its MIME boundary.
+    Returns (part_headers, body_start, body_end) or None if there is no HTML part.
+    """
+    top_headers, body_start = _read_mime_headers(mm, 0)
+    content_type = top_headers.get('content-type', '')
+    boundary = _header_param(content_type, 'boundary')
+
+    if not boundary:
+        # Not multipart: the whole body is the document if it is HTML
+        if content_type.lower().startswith('text/html'):
+            return top_headers, body_start, len(mm)
+        return None
+
+    delimiter = b'--' + boundary.encode('latin-1')
+    position = mm.find(delimiter, 0)
+    while position != -1:
+        if mm[position + len(delimiter):position + len(delimiter) + 2] == b'--':
+            return None # Closing delimiter, no more parts
+        mm.seek(position)
+        mm.readline() # Skip the rest of the delimiter line
+        part_headers, part_start = _read_mime_headers(mm, mm.tell())
+        next_position = mm.find(b'\n' + delimiter, part_start)
+        part_end = next_position if next_position != -1 else len(mm)
+        if part_headers.get('content-type', '').lower().startswith('text/html'):
+            if part_end > part_start and mm[part_end - 1:part_end] == b'\r':
+                part_end -= 1 # The CRLF before the delimiter belongs to the delimiter
+            return part_headers, part_start, part_end
+        position = next_position + 1 if next_position != -1 else -1
+    return None
+
+def _iter_decoded_payload(mm, start, end, transfer_encoding, chunk_size, progress_callback=None):
+    """
+    Yields the transfer-decoded bytes of mm[start:end], at most about `chunk_size` at a time.
+    Quoted-printable and base64 are decoded incrementally; partial escapes are carried over.
+    progress_callback gets the percentage of the encoded payload consumed after each chunk.
+    """
+    transfer_encoding = (transfer_encoding or '7bit').strip().lower()
+    carry = b''
+    for chunk_start in range(start, end, chunk_size):
+        chunk_end = min(chunk_start + chunk_size, end)
+        is_last = chunk_end == end
+        report_progress(progress_callback, 100 * (chunk_start - start) / max(1, end - start))
+        data = carry + mm[chunk_start:chunk_end]
+
+        if transfer_encoding == 'quoted-printable':
+            if is_last:
+                cut = len(data)
+            else:
+                # Only decode complete lines so escapes and soft breaks are never split
+                cut = data.rfind(b'\n') + 1
+                if cut == 0:
+                    tail = data[-2:]
+                    cut = len(data) - 2 + tail.index(b'=') if b'=' in tail else len(data)
+            carry = data[cut:]
+            yield binascii.a2b_qp(data[:cut])
+
+        elif transfer_encoding == 'base64':
+            data = b''.join(data.split())
+            cut = len(data) if is_last else len(data) // 4 * 4
+            carry = data[cut:]
+            yield binascii.a2b_base64(data[:cut]) if cut else b''
+
+        else: # 7bit / 8bit / binary are passed through unchanged
+            yield data
+
+    if carry:
+        yield binascii.a2b_qp(carry) if transfer_encoding == 'quoted-printable' else carry
+    report_progress(progress_callback, 100)
+
+def iter_html_from_mhtml(mhtml_file_path, chunk_size=HTML_CHUNK_SIZE, progress_callback=None):
+    """
+    Streaming version of extract_html_from_mhtml. Memory-maps the file, finds the
+    text/html part by its MIME boundary and yields the decoded HTML as text chunks,
+    so peak memory is bounded by `chunk_size` instead of the size of the export.
+    """
+    with open(mhtml_file_path, 'rb') as fp:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            html_part = _find_html_part(mm)
+            if html_part is None:
+                print(f"No text/html part found in '{mhtml_file_path}'.")
+                return
+            part_headers, body_start, body_end = html_part
+
+            charset = _header_param(part_headers.get('content-type'), 'charset') or 'utf-8'
             try:
-                cleaned_series = df_converted[col].astype(str).str.strip()
-                is_negative = cleaned_series.str.startswith('(') & cleaned_series.str.endswith(')')
-                cleaned_series = cleaned_series.str.replace(r'[\(\)]', '', regex=True) # Remove parentheses
-                cleaned_series = cleaned_series.str.replace(r'[$,%]', '', regex=True)
-                cleaned_series = cleaned_series.str.replace(r',(?=\d{3})', '', regex=True) # Remove thousand separator commas
-                numeric_series = pd.to_numeric(cleaned_series, errors='coerce')
-
-                # If conversion was largely successful (not all NaN), update the column
-                if not numeric_series.isnull().all():
-                    numeric_series.loc[is_negative] = -numeric_series.loc[is_negative]
-                    df_converted[col] = numeric_series
-                    print(f"Column '{col}' converted to numeric.")
+                decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+            except LookupError:
+                decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+            payload = _iter_decoded_payload(mm, body_start, body_end,
+                                            part_headers.get('content-transfer-encoding'), chunk_size,
+                                            progress_callback)
+            for decoded_bytes in payload:
+                text = decoder.decode(decoded_bytes)
+                if text:
+                    yield text
+            text = decoder.decode(b'', final=True)
+            if text:
+                yield text
+
+# --- ZANALYSIS table parser ---
+# SAP's "Excel 2003" HTML export styles every cell of the data table with one of these
+# classes (x1-x3 header cells, x4/x5 alternating body cells); the title table only uses x0.
+SAP_DATA_TABLE_CLASSES = {'x1', 'x2', 'x3', 'x4', 'x5'}
+
+_RE_CELL_WHITESPACE = re.compile(r"[\r\n]+|\s{2,}") # Same whitespace collapsing as pd.read_html
+
+def _cell_text(cell):
+    text = cell.text if len(cell) == 0 else ''.join(cell.itertext()) # Most SAP cells have no child markup
+    if not text:
+        return None
+    text = _RE_CELL_WHITESPACE.sub(' ', text.strip())
+    return text if text else None
+
+def _columns_to_dataframe(rows):
+    """
+    Builds a DataFrame with integer column labels (like pd.read_html) from parsed rows,
+    one column array at a time.
+    """
+    width = max((len(row) for row in rows), default=0)
+    columns = {}
+    for col_idx in range(width):
+        columns[col_idx] = [row[col_idx] if col_idx < len(row) else None for row in rows]
+    return pd.DataFrame(columns, dtype=object)
+
+def _table_size(rows):
+    return len(rows) * max(map(len, rows)) # Same measure as DataFrame.size
+
+# --- SAP layout fingerprinting ---
+SAP_HEADER_ROWS = 2 # Month/measure band, then field labels
+
+# Identity columns kept from the export: (field label, which occurrence, report name).
+# SAP spans key + text under one label, e.g. customer number and name; we keep the text.
+SAP_IDENTITY_COLUMNS = [
+    ('Snapshot Date', 0, 'Date'),
+    ('Parent Customer', -1, 'Legal Name'),
+    ('Profit Center', -1, 'Pkg'),
+    ('PDL', 0, 'PDL'),
+]
+
+_sap_layout_cache = {} # fingerprint -> resolved layout
+
+def sap_layout_fingerprint(header_rows):
+    """
+    Returns a stable hash of the header rows of a SAP export, identifying its column layout.
+    """
+    digest = hashlib.sha1()
+    for row in header_rows:
+        digest.update('\x1f'.join(cell or '' for cell in row).encode('utf-8'))
+        digest.update(b'\x1e')
+    return digest.hexdigest()
+
+def resolve_sap_layout(header_rows):
+    """
+    Maps the header rows of a SAP export to the raw column positions the reports use:
+    the identity columns in SAP_IDENTITY_COLUMNS, then every month/measure column.
+    Layouts are cached by fingerprint. Raises ValueError if a required column is missing,
+    so a changed export fails loudly instead of shifting columns.
+    """
+    fingerprint = sap_layout_fingerprint(header_rows)
+    layout = _sap_layout_cache.get(fingerprint)
+    if layout is not None:
+        return layout
+
+    band_row, label_row = header_rows[0], header_rows[1]
+    columns = []
+    report_headers = []
+    for label, occurrence, report_name in SAP_IDENTITY_COLUMNS:
+        positions = [i for i, cell in enumerate(label_row) if cell == label]
+        if not positions:
+            raise ValueError(f"SAP export layout {fingerprint[:8]} has no '{label}' column.")
+        columns.append(positions[occurrence])
+        report_headers.append(' ' + report_name)
+
+    for i, label in enumerate(label_row):
+        band = band_row[i] if i < len(band_row) else None
+        if band and label: # e.g. 'JUN 2025 Unit Starts' / 'Demand'
+            columns.append(i)
+            report_headers.append(band.split(' ')[0] + ' ' + label) # Header of the 'remove' sheet, see modify_headers
+
+    layout = {'fingerprint': fingerprint, 'columns': columns, 'report_headers': report_headers}
+    _sap_layout_cache[fingerprint] = layout
+    print(f"Resolved SAP layout {fingerprint[:8]}: keeping {len(columns)} of {len(label_row)} columns.")
+    return layout
+
+def parse_zanalysis_table(html_chunks, project_layout=False):
+    """
+    Parses the data table of a SAP ZANALYSIS (Excel 2003 HTML) export from an iterable of
+    HTML text chunks, e.g. iter_html_from_mhtml. Rows are read as they stream in and
+    discarded from the parse tree once their cells are captured.
+
+    The data table is recognised by its SAP cell classes, so parsing stops as soon as it
+    ends. If no table carries those classes, the largest table is returned instead.
+
+    With project_layout=True the SAP header rows are resolved with resolve_sap_layout and
+    only the mapped columns are materialised; the layout is
+    stored in df.attrs['sap_layout'] and the first SAP_HEADER_ROWS rows are the headers.
+    Returns a DataFrame of raw cell strings (None for empty cells), or None if no table was found.
+    """
+    from lxml import etree
+
+    parser = etree.HTMLPullParser(events=('end',), tag=('table', 'tr', 'td', 'th'), huge_tree=True)
+    table_rows = []
+    is_sap_table = False
+    current_row = []
+    col_position = 0
+    keep_positions = None # raw column -> True once the layout is resolved
+    layout = None
+    fallback_rows = None
+
+    for chunk in html_chunks:
+        parser.feed(chunk)
+        for _, elem in parser.read_events():
+            tag = elem.tag
+            if tag == 'td' or tag == 'th':
+                if not is_sap_table and elem.get('class') in SAP_DATA_TABLE_CLASSES:
+                    is_sap_table = True
+                span = elem.get('colspan')
+                if span is None:
+                    span = 1
+                else:
+                    try:
+                        span = max(int(span), 1)
+                    except ValueError:
+                        span = 1
+
+                if keep_positions is None:
+                    current_row.extend([_cell_text(elem)] * span) # Spanned cells repeat their value, as in pd.read_html
+                else:
+                    text = None
+                    for position in range(col_position, col_position + span):
+                        if position in keep_positions:
+                            if text is None:
+                                text = _cell_text(elem)
+                            current_row.append((keep_positions[position], text))
+                col_position += span
+
+            elif tag == 'tr':
+                if keep_positions is None:
+                    table_rows.append(current_row)
                 else:
-                    print(f"Column '{col}' could not be converted to numeric (all values became NaN after trying). Kept as object.")
+                    row = [None] * len(layout['columns'])
+                    for out_idx, text in current_row:
+                        row[out_idx] = text
+                    table_rows.append(row)
+                current_row = []
+                col_position = 0
+
+                if project_layout and is_sap_table and keep_positions is None and len(table_rows) == SAP_HEADER_ROWS:
+                    layout = resolve_sap_layout(table_rows)
+                    keep_positions = {raw: out for out, raw in enumerate(layout['columns'])}
+                    table_rows = [[row[raw] if raw < len(row) else None for raw in layout['columns']] for row in table_rows]
+
+                # Drop the finished row (and anything before it) from the tree to keep memory flat
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+            elif tag == 'table':
+                if is_sap_table and table_rows:
+                    parser.close()
+                    return _finish_table(table_rows, layout)
+                if table_rows and (fallback_rows is None or _table_size(table_rows) > _table_size(fallback_rows)):
+                    fallback_rows = table_rows
+                table_rows = []
+                is_sap_table = False
+                elem.clear()
+
+    parser.close()
+    if table_rows and (is_sap_table or fallback_rows is None): # Unterminated table at end of document
+        return _finish_table(table_rows, layout)
+    if fallback_rows:
+        return _columns_to_dataframe(fallback_rows)
+    return None
 
-            except Exception as e:
-                print(f"Could not convert column '{col}' to numeric: {e}. Kept as object.")
+def _finish_table(rows, layout):
+    df = _columns_to_dataframe(rows)
+    if layout is not None:
+        df.attrs['sap_layout'] = layout
+    return df
+
+# --- Numeric cleaning ---
+NUMERIC_SAMPLE_SIZE = 256 # Non-empty cells inspected before committing to converting a column
+_NUMERIC_JUNK = str.maketrans('', '', '()$,%') # Parentheses, currency, thousands separators, percent
+NUMERIC_WORKERS = os.cpu_count() or 1 # Processes cleaning the numeric columns of one export
+PARALLEL_NUMERIC_MIN_CELLS = 1000000 # Smaller bodies are cleaned in-process; starting a pool costs more than it saves
+
+def _parse_accounting_number(value):
+    """
+    Converts one accounting-formatted cell ('1,234', '$ 2.52', '(500)', '12%') to a float.
+    Numbers pass through; anything that is not a number becomes NaN.
+    """
+    if isinstance(value, (int, float, np.number)):
+        return float(value)
+    if value is None:
+        return math.nan
+    text = str(value).strip()
+    is_negative = text[:1] == '(' and text[-1:] == ')'
+    text = text.translate(_NUMERIC_JUNK)
+    if '_' in text: # float() accepts digit separators, pd.to_numeric never did
+        return math.nan
+    try:
+        number = float(text)
+    except ValueError:
+        return math.nan
+    return -number if is_negative else number
+
+def _sample_is_numeric(values):
+    """
+    Decides from an evenly spaced sample of non-empty cells whether a column is worth converting.
+    Returns False only if non-empty cells were sampled and none of them parsed.
+    """
+    step = max(len(values) // NUMERIC_SAMPLE_SIZE, 1)
+    sampled_any = False
+    for value in values[::step]:
+        if value is None or value == '' or (isinstance(value, float) and math.isnan(value)):
+            continue
+        sampled_any = True
+        if not math.isnan(_parse_accounting_number(value)):
+            return True
+    return not sampled_any # Too sparse to judge from the sample, do the full conversion
+
+def _convert_column_batch(batch):
+    """
+    Converts a batch of (position, object values) pairs. Returns (position, float array or None)
+    pairs, None meaning the column stays as text. Top-level so it can run in a worker process.
+    """
+    results = []
+    for position, values in batch:
+        if not _sample_is_numeric(values):
+            results.append((position, None))
+            continue
+        numbers = np.fromiter(map(_parse_accounting_number, values), dtype=np.float64, count=len(values))
+        results.append((position, None if np.isnan(numbers).all() else numbers))
+    return results
+
+def clean_and_convert_numeric(df, max_workers=None, batch_size=8, progress_callback=None):
+    """
+    Attempts to clean and convert columns in a DataFrame to numeric types.
+    Text columns are parsed in a single pass per column into float64 arrays; a column is
+    kept as text if a sample of its cells (or, failing that, every cell) is non-numeric.
+    With max_workers > 1 and at least PARALLEL_NUMERIC_MIN_CELLS cells, batches of `batch_size`
+    columns are converted in worker processes.
+    """
+    candidates = [(i, df.iloc[:, i].to_numpy(dtype=object)) for i in range(df.shape[1])
+                  if df.iloc[:, i].dtype == 'object']
+    batches = [candidates[i:i + batch_size] for i in range(0, len(candidates), batch_size)]
+
+    results = []
+    if max_workers and max_workers > 1 and len(batches) > 1 and df.size >= PARALLEL_NUMERIC_MIN_CELLS:
+        try:
+            with ProcessPoolExecutor(max_workers=min(max_workers, len(batches))) as pool:
+                for batch_number, batch_result in enumerate(pool.map(_convert_column_batch, batches), 1):
+                    results.extend(batch_result)
+                    report_progress(progress_callback, 100 * batch_number / len(batches))
+        except OperationCancelled:
+            raise
+        except Exception as e:
+            print(f"Parallel numeric conversion failed ({e}). Falling back to a single process.")
+            results = []
+    if not results:
+        for batch_number, batch in enumerate(batches, 1):
+            results.extend(_convert_column_batch(batch))
+            report_progress(progress_callback, 100 * batch_number / len(batches))
+
+    df_converted = df.copy(deep=False) # Columns are replaced, never modified in place
+    column_labels = df.columns.tolist()
+    kept_as_text = []
+    for position, numbers in results:
+        if numbers is None:
+            kept_as_text.append(column_labels[position])
+        else:
+            df_converted.isetitem(position, numbers)
+    print(f"Converted {len(results) - len(kept_as_text)} of {len(results)} text columns to numeric. "
+          f"Kept as text: {kept_as_text}")
     return df_converted
 
 
-def convert_mhtml_to_excel(mhtml_file_path, output_excel_path, sheet_name="Sheet1"):
+# --- Parsed export cache ---
+# Parsed exports are cached on disk keyed by the file's content hash and PARSER_VERSION, so re-running
+# the pipeline on the same export skips the MHTML parse. Bump PARSER_VERSION whenever parsing or
+# numeric cleaning changes what parse_sap_export returns.
+PARSER_VERSION = 2
+PARSE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "parse_cache")
+PARSE_CACHE_MAX_BYTES = 512 * 1024 * 1024 # Least recently used entries are evicted beyond this
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+
+try:
+    import pyarrow.feather as feather # Optional: columnar, memory-mappable cache entries
+except ImportError:
+    feather = None
+
+def file_content_hash(file_path):
     """
-    Extracts tables from an MHTML file, converts the primary table to a DataFrame,
-    attempts numeric conversion, and saves it to an Excel file.
+    Returns the SHA-256 hex digest of a file's contents.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as fp:
+        for block in iter(lambda: fp.read(HASH_CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _cache_entry_paths(cache_dir, key):
+    base = os.path.join(cache_dir, key)
+    return {'meta': base + '.json', 'feather': base + '.feather', 'pickle': base + '.pkl'}
+
+def _write_atomic(path, write):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def load_cached_parse(cache_dir, key):
+    """
+    Returns the cached (info_row_dfs, df_cleaned_data) for key, or None on a miss.
+    """
+    paths = _cache_entry_paths(cache_dir, key)
+    try:
+        with open(paths['meta'], 'r', encoding='utf-8') as fp:
+            meta = json.load(fp)
+        if meta.get('parser_version') != PARSER_VERSION:
+            return None
+        if meta['format'] == 'feather':
+            if feather is None:
+                return None
+            df_cleaned_data = feather.read_feather(paths['feather'], memory_map=True)
+            df_cleaned_data.columns = range(df_cleaned_data.shape[1])
+        else:
+            with open(paths['pickle'], 'rb') as fp:
+                df_cleaned_data = pickle.load(fp)
+    except (OSError, ValueError, KeyError, pickle.UnpicklingError, EOFError):
+        return None
+
+    now = time.time()
+    for path in paths.values():
+        try:
+            os.utime(path, (now, now)) # Eviction is least-recently-used by mtime
+        except OSError:
+            pass # Not part of this entry's format, or evicted meanwhile by another process
+    df_cleaned_data.attrs['sap_layout'] = meta['sap_layout']
+    info_row_dfs = [pd.DataFrame([row]) for row in meta['info_rows']]
+    return info_row_dfs, df_cleaned_data
+
+def store_cached_parse(cache_dir, key, info_row_dfs, df_cleaned_data, max_bytes=PARSE_CACHE_MAX_BYTES):
+    """
+    Stores a parse result under key (Feather when pyarrow is installed, pickle otherwise),
+    then evicts old entries beyond max_bytes. Failures only cost the cache, never the run.
+    """
+    paths = _cache_entry_paths(cache_dir, key)
+    meta = {
+        'parser_version': PARSER_VERSION,
+        'sap_layout': df_cleaned_data.attrs.get('sap_layout'),
+        'info_rows': [df_info.iloc[0].tolist() for df_info in info_row_dfs],
+    }
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        data = df_cleaned_data.copy(deep=False)
+        data.attrs = {}
+        stored = False
+        if feather is not None:
+            try:
+                data.columns = [str(c) for c in data.columns]
+                _write_atomic(paths['feather'], lambda p: feather.write_feather(data, p, compression='uncompressed'))
+                meta['format'] = 'feather'
+                stored = True
+            except Exception:
+                data.columns = range(data.shape[1]) # Mixed-type text columns can't go to Arrow
+        if not stored:
+            def write_pickle(p):
+                with open(p, 'wb') as fp:
+                    pickle.dump(data, fp, protocol=pickle.HIGHEST_PROTOCOL)
+            _write_atomic(paths['pickle'], write_pickle)
+            meta['format'] = 'pickle'
+        def write_meta(p):
+            with open(p, 'w', encoding='utf-8') as fp:
+                json.dump(meta, fp)
+        _write_atomic(paths['meta'], write_meta) # Written last: an entry only counts once its meta exists
+        evict_parse_cache(cache_dir, max_bytes)
+    except Exception as e:
+        print(f"Warning: could not cache parsed export: {e}")
+
+def evict_parse_cache(cache_dir, max_bytes=PARSE_CACHE_MAX_BYTES):
+    """
+    Deletes least recently used cache entries until the cache fits in max_bytes.
+    Other processes may be writing or evicting at the same time: files that vanish are skipped,
+    and in-progress '.tmp' writes are left alone.
+    """
+    entries = {}
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.tmp'):
+            continue
+        try:
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+        except OSError:
+            continue
+        key = entry.name.split('.', 1)[0]
+        size, last_used = entries.get(key, (0, 0))
+        entries[key] = (size + stat.st_size, max(last_used, stat.st_mtime))
+
+    total = sum(size for size, _ in entries.values())
+    for key, (size, _) in sorted(entries.items(), key=lambda item: item[1][1]):
+        if total <= max_bytes:
+            break
+        for name in os.listdir(cache_dir):
+            if name.split('.', 1)[0] == key and not name.endswith('.tmp'):
+                try:
+                    os.remove(os.path.join(cache_dir, name))
+                except OSError:
+                    pass
+        total -= size
+
+def parse_sap_export(mhtml_file_path, cache_dir=PARSE_CACHE_DIR, progress_callback=None, numeric_workers=NUMERIC_WORKERS):
+    """
+    Extracts the primary table from an MHTML file, projects the report columns and
+    attempts numeric conversion. Returns (info_row_dfs, df_cleaned_data): the SAP header
+    rows as one-row DataFrames and the cleaned body. Returns None on failure.
+    Results are cached in cache_dir by content hash; pass cache_dir=None to always parse.
+    progress_callback(percent) follows the parse (by payload consumed) and the numeric cleaning.
+    numeric_workers is passed to clean_and_convert_numeric as max_workers; use 1 where exports
+    are already processed in parallel (see pipeline.process_export).
     """
     if not os.path.exists(mhtml_file_path):
         print(f"Error: Input MHTML file not found at '{mhtml_file_path}'")
-        return False
+        return None
 
     base_name = os.path.basename(mhtml_file_path)
+    cache_key = None
+    if cache_dir:
+        with stage('cache_lookup', bytes_read=os.path.getsize(mhtml_file_path)) as lookup_stage:
+            cache_key = f"{file_content_hash(mhtml_file_path)}-v{PARSER_VERSION}"
+            cached = load_cached_parse(cache_dir, cache_key)
+            lookup_stage['hit'] = cached is not None
+            if cached is not None:
+                lookup_stage['rows_out'] = len(cached[1])
+        if cached is not None:
+            print(f"Loaded parsed data for '{base_name}' from cache.")
+            report_progress(progress_callback, 100)
+            return cached
+
     print(f"Processing MHTML file: '{base_name}'")
-    html_string = extract_html_from_mhtml(mhtml_file_path)
+    try:
+        # Stream the HTML part instead of materialising the whole document; peek at the
+        # first chunk so a missing/unreadable HTML part is reported before parsing starts
+        html_chunks = iter_html_from_mhtml(mhtml_file_path, progress_callback=scaled_progress(progress_callback, 0, 85))
+        first_chunk = next(html_chunks, None)
+    except OperationCancelled:
+        raise
+    except Exception as e:
+        print(f"Error reading or parsing MHTML file '{mhtml_file_path}': {e}")
+        first_chunk = None
+
+    if not first_chunk:
+        print(f"Could not extract HTML content from '{base_name}'.")
+        return None
 
-    if html_string:
-        print(f"Successfully extracted HTML content from '{base_name}'.")
+    print(f"Successfully located HTML content in '{base_name}'.")
+    with stage('parse', bytes_read=os.path.getsize(mhtml_file_path)) as parse_stage:
         try:
-            print("Attempting to parse tables with pd.read_html...")
-            list_of_dfs = pd.read_html(html_string, thousands=',', decimal='.') # Tell read_html about separators
-                                                                                # This helps sometimes, but manual cleaning is often safer
-            
-            if list_of_dfs:
-                df_raw = max(list_of_dfs, key=lambda d: d.size) if len(list_of_dfs) > 1 else list_of_dfs[0]
-                print(f"Successfully parsed HTML table from '{base_name}' into DataFrame.")
-
-                # Attempt to clean and convert numeric columns
-                print("Attempting to clean and convert numeric data...")
-
-                info_row_dfs_to_write = []
-                df_raw = df_raw.drop(columns=[7, 4, 2, 0]).reset_index(drop=True)
-                for i in range(2):
-                    info_row_series = df_raw.iloc[i].fillna('')
-                    info_row_dfs_to_write.append(pd.DataFrame([info_row_series.tolist()]))
-    
-
-                
-                df_cleaned_data = clean_and_convert_numeric(df_raw)
-                df_cleaned_data = df_cleaned_data.drop(index=[0, 1, 2]).reset_index(drop=True)
-                # --- Saving to Excel ---
-                try:
-                    excel_engine = None
-                    if output_excel_path.lower().endswith('.xlsx'):
-                        excel_engine = 'openpyxl'
-                    elif output_excel_path.lower().endswith('.xls'):
-                        excel_engine = 'xlwt' # Note: xlwt has limitations (e.g., >256 cols, specific formats)
-                    else:
-                        print(f"Warning: Output file '{output_excel_path}' has an unrecognized Excel extension. Defaulting to .xlsx.")
-                        output_excel_path += ".xlsx"
-                        excel_engine = 'openpyxl'
-
-                    with pd.ExcelWriter(output_excel_path, engine=excel_engine) as writer:
-                        current_excel_row = 0
-                        # Write info rows
-                        for i, df_info in enumerate(info_row_dfs_to_write):
-                            print(f"Writing info row {i+1} to Excel...")
-                            df_info.to_excel(writer, sheet_name=sheet_name,
-                                            startrow=current_excel_row,
-                                            header=False, index=False)
-                            current_excel_row += df_info.shape[0] # Should be 1
-
-                        # Write the main data DataFrame (with its own headers)
-                        if not df_cleaned_data.columns.empty: # Check if there are columns to write
-                            print("Writing main data (with headers) to Excel...")
-                            df_cleaned_data.to_excel(writer, sheet_name=sheet_name,
-                                                    startrow=current_excel_row,
-                                                    index=False, header=False) # index=False to not write pandas index
-                            
-
-                        
-                        elif not df_cleaned_data.empty : # A failsafe, if it's 0x0 but not caught by columns.empty
-                            print("Writing main data (empty but not 0x0) to Excel...")
-                            df_cleaned_data.to_excel(writer, sheet_name=sheet_name,
-                                                    startrow=current_excel_row,
-                                                    index=False)
-                        else:
-                            print("No actual data (neither headers nor rows) to write for the main data section.")
-
-                    print(f"Data successfully saved to '{output_excel_path}' in sheet '{sheet_name}'.")
-                    return True
-            
-                except ImportError as ie:
-                    # ... (error handling for saving as before)
-                    if 'openpyxl' in str(ie).lower(): print("Error: 'openpyxl' library is required to save to .xlsx files. Please install it: pip install openpyxl")
-                    elif 'xlwt' in str(ie).lower(): print("Error: 'xlwt' library is required to save to .xls files. Please install it: pip install xlwt")
-                    else: print(f"ImportError while saving to Excel: {ie}")
-                    return False
-                except Exception as e_save:
-                    print(f"Error saving DataFrame to Excel '{output_excel_path}': {e_save}")
-                    return False
-            else:
-                print(f"No tables found in the HTML content of '{base_name}' using pd.read_html.")
-                return False
+            print("Attempting to parse the ZANALYSIS data table...")
+            df_raw = parse_zanalysis_table(itertools.chain([first_chunk], html_chunks), project_layout=True)
         except ImportError:
-            print("Error: 'lxml' or 'html5lib' not installed for pd.read_html. Please install them: pip install lxml html5lib pandas")
-            return False
-        except ValueError as ve:
-            print(f"ValueError with pd.read_html for '{base_name}' (e.g., no tables or parse error): {ve}")
-            return False
+            print("Error: 'lxml' is not installed for parsing the HTML export. Please install it: pip install lxml pandas")
+            return None
+        except OperationCancelled:
+            raise
         except Exception as e_parse:
-            print(f"Error parsing HTML tables from '{base_name}' with pd.read_html: {e_parse}")
-            return False
-    else:
-        print(f"Could not extract HTML content from '{base_name}'.")
+            print(f"Error parsing HTML tables from '{base_name}': {e_parse}")
+            return None
+        parse_stage['rows_out'] = len(df_raw) if df_raw is not None else 0
+
+    if df_raw is None:
+        print(f"No tables found in the HTML content of '{base_name}'.")
+        return None
+    if 'sap_layout' not in df_raw.attrs:
+        print(f"Error: '{base_name}' does not look like a SAP ZANALYSIS export (no SAP-styled data table).")
+        return None
+    print(f"Successfully parsed HTML table from '{base_name}' into DataFrame.")
+
+    # The parser already projected the report columns; the header rows become info rows
+    info_row_dfs = []
+    for i in range(SAP_HEADER_ROWS):
+        info_row_series = df_raw.iloc[i].fillna('')
+        info_row_dfs.append(pd.DataFrame([info_row_series.tolist()]))
+
+    # Attempt to clean and convert numeric columns
+    print("Attempting to clean and convert numeric data...")
+    df_body = df_raw.iloc[SAP_HEADER_ROWS:].reset_index(drop=True)
+    with stage('clean_numeric', rows_in=len(df_body)) as clean_stage:
+        df_cleaned_data = clean_and_convert_numeric(df_body, max_workers=numeric_workers,
+                                                    progress_callback=scaled_progress(progress_callback, 85, 100))
+        clean_stage['rows_out'] = len(df_cleaned_data)
+    df_cleaned_data.attrs['sap_layout'] = df_raw.attrs['sap_layout']
+    if cache_key:
+        store_cached_parse(cache_dir, cache_key, info_row_dfs, df_cleaned_data)
+    return info_row_dfs, df_cleaned_data
+
+# --- Converted frame ---
+SUB_HEADERS_ATTR = 'sub_headers' # Row 0 of a converted frame, whose numeric columns hold NaN there
+
+def body_row_count(df : pd.DataFrame) -> int:
+    """Export rows in a converted frame, not counting row 0 (the sub-headers)."""
+    return max(len(df) - 1, 0)
+
+def _excel_header_labels(labels):
+    """
+    Column labels as pd.read_excel derives them from a header row: blanks become
+    'Unnamed: <i>' and repeats get '.1', '.2', ... suffixes.
+    """
+    header = []
+    seen = {}
+    for i, label in enumerate(labels):
+        label = f"Unnamed: {i}" if label == '' else str(label)
+        candidate = label
+        while candidate in seen:
+            seen[label] += 1
+            candidate = f"{label}.{seen[label]}"
+        seen.setdefault(label, 0)
+        seen.setdefault(candidate, 0)
+        header.append(candidate)
+    return header
+
+def converted_frame(info_row_dfs, df_cleaned_data, compact=False):
+    """
+    Builds, in memory, the sheet written by convert_mhtml_to_excel as a typed frame: the first
+    info row as the header (labelled as pd.read_excel would), the second as row 0, then the data.
+    Text columns hold '' for blanks as the Excel round trip gave; numeric columns stay float64
+    with NaN, so row 0 holds NaN there and the sub-headers are kept in df.attrs[SUB_HEADERS_ATTR]
+    (read them with rollup.sub_headers). Blank cells are only written as such at the Excel boundary.
+    With compact=True the body goes through compact_frame first; its categorical columns get
+    row 0 and the '' blanks as categories.
+    """
+    header = _excel_header_labels(info_row_dfs[0].iloc[0].tolist())
+    sub_headers = info_row_dfs[1].iloc[0].tolist()
+    body = compact_frame(df_cleaned_data) if compact else df_cleaned_data
+    columns = {}
+    for i, label in enumerate(header):
+        column = body.iloc[:, i]
+        sub_header = sub_headers[i] if isinstance(sub_headers[i], str) else ''
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            categories = sorted(set(column.cat.categories) | {sub_header, ''})
+            codes = column.cat.set_categories(categories).fillna('').cat.codes.to_numpy()
+            codes = np.concatenate([np.array([categories.index(sub_header)], dtype=codes.dtype), codes])
+            columns[label] = pd.Categorical.from_codes(codes, categories)
+        elif pd.api.types.is_float_dtype(column.dtype):
+            values = column.to_numpy()
+            columns[label] = np.concatenate([np.array([np.nan], dtype=values.dtype), values])
+        else:
+            values = column.to_numpy(dtype=object)
+            values = np.where(pd.isna(values), '', values)
+            columns[label] = np.concatenate([np.array([sub_header], dtype=object), values])
+    df = pd.DataFrame(columns)
+    df.attrs['sap_layout'] = df_cleaned_data.attrs.get('sap_layout')
+    df.attrs[SUB_HEADERS_ATTR] = list(sub_headers)
+    return df
+
+# --- Compact mode ---
+CATEGORY_MAX_RATIO = 0.5 # Text columns with at most this share of distinct values become categoricals
+
+def frame_memory(df : pd.DataFrame) -> int:
+    """Bytes held by df, strings included."""
+    return int(df.memory_usage(deep=True, index=True).sum())
+
+def _lossless_float32(values : np.ndarray) -> bool:
+    with np.errstate(over='ignore', invalid='ignore'):
+        return bool(np.array_equal(values.astype(np.float32).astype(np.float64), values, equal_nan=True))
+
+def compact_frame(df : pd.DataFrame) -> pd.DataFrame:
+    """
+    Compact copy of a parsed export body: low-cardinality text columns (Legal Name, Pkg, Plant, ...)
+    become categoricals with sorted categories, so sorting and grouping order is unchanged, and
+    float64 columns become float32 when every value survives the round trip. The index is a RangeIndex.
+    """
+    columns = {}
+    for position in range(df.shape[1]):
+        column = df.iloc[:, position]
+        if column.dtype == np.float64 and _lossless_float32(column.to_numpy()):
+            columns[position] = column.to_numpy().astype(np.float32)
+        elif column.dtype == object and column.nunique() <= CATEGORY_MAX_RATIO * max(1, len(column)):
+            columns[position] = column.astype('category').array
+        else:
+            columns[position] = column.array
+    compact = pd.DataFrame(columns, index=pd.RangeIndex(len(df)))
+    compact.columns = df.columns
+    compact.attrs = dict(df.attrs)
+    return compact
+
+def write_converted_excel(info_row_dfs, df_cleaned_data, output_excel_path, sheet_name="Sheet1"):
+    """
+    Saves the info rows and the cleaned data to an Excel file. Returns True on success.
+    """
+    try:
+        excel_engine = None
+        if output_excel_path.lower().endswith('.xlsx'):
+            excel_engine = 'openpyxl'
+        elif output_excel_path.lower().endswith('.xls'):
+            excel_engine = 'xlwt' # Note: xlwt has limitations (e.g., >256 cols, specific formats)
+        else:
+            print(f"Warning: Output file '{output_excel_path}' has an unrecognized Excel extension. Defaulting to .xlsx.")
+            output_excel_path += ".xlsx"
+            excel_engine = 'openpyxl'
+
+        with stage('write_converted', rows_out=len(df_cleaned_data), written_path=output_excel_path), \
+                pd.ExcelWriter(output_excel_path, engine=excel_engine) as writer:
+            current_excel_row = 0
+            # Write info rows
+            for i, df_info in enumerate(info_row_dfs):
+                print(f"Writing info row {i+1} to Excel...")
+                df_info.to_excel(writer, sheet_name=sheet_name,
+                                startrow=current_excel_row,
+                                header=False, index=False)
+                current_excel_row += df_info.shape[0] # Should be 1
+
+            # Write the main data DataFrame (with its own headers)
+            if not df_cleaned_data.columns.empty: # Check if there are columns to write
+                print("Writing main data (with headers) to Excel...")
+                df_cleaned_data.to_excel(writer, sheet_name=sheet_name,
+                                        startrow=current_excel_row,
+                                        index=False, header=False) # index=False to not write pandas index
+            elif not df_cleaned_data.empty : # A failsafe, if it's 0x0 but not caught by columns.empty
+                print("Writing main data (empty but not 0x0) to Excel...")
+                df_cleaned_data.to_excel(writer, sheet_name=sheet_name,
+                                        startrow=current_excel_row,
+                                        index=False)
+            else:
+                print("No actual data (neither headers nor rows) to write for the main data section.")
+
+        print(f"Data successfully saved to '{output_excel_path}' in sheet '{sheet_name}'.")
+        return True
+
+    except ImportError as ie:
+        if 'openpyxl' in str(ie).lower(): print("Error: 'openpyxl' library is required to save to .xlsx files. Please install it: pip install openpyxl")
+        elif 'xlwt' in str(ie).lower(): print("Error: 'xlwt' library is required to save to .xls files. Please install it: pip install xlwt")
+        else: print(f"ImportError while saving to Excel: {ie}")
+        return False
+    except Exception as e_save:
+        print(f"Error saving DataFrame to Excel '{output_excel_path}': {e_save}")
         return False
 
+def convert_mhtml_to_excel(mhtml_file_path, output_excel_path, sheet_name="Sheet1", cache_dir=PARSE_CACHE_DIR,
+                           progress_callback=None, numeric_workers=NUMERIC_WORKERS):
+    """
+    Extracts tables from an MHTML file, converts the primary table to a DataFrame,
+    attempts numeric conversion, and saves it to an Excel file.
+    """
+    parsed = parse_sap_export(mhtml_file_path, cache_dir, progress_callback, numeric_workers)
+    if parsed is None:
+        return False
+    info_row_dfs, df_cleaned_data = parsed
+    return write_converted_excel(info_row_dfs, df_cleaned_data, output_excel_path, sheet_name)
+
+def convert_mhtml_to_dataframe(mhtml_file_path, spill_excel_path=None, sheet_name="Sheet1", cache_dir=PARSE_CACHE_DIR,
+                               progress_callback=None, compact=False, numeric_workers=NUMERIC_WORKERS):
+    """
+    In-memory version of convert_mhtml_to_excel: returns the converted sheet as a DataFrame
+    (see converted_frame) for remove_specified_rows.apply_conditional_formatting, or None.
+    The Excel file is only written if spill_excel_path is given, e.g. for debugging.
+    compact=True returns the compact form (categoricals, float32) and prints the memory it saves.
+    """
+    parsed = parse_sap_export(mhtml_file_path, cache_dir, progress_callback, numeric_workers)
+    if parsed is None:
+        return None
+    info_row_dfs, df_cleaned_data = parsed
+    if spill_excel_path:
+        write_converted_excel(info_row_dfs, df_cleaned_data, spill_excel_path, sheet_name)
+    if not compact:
+        return converted_frame(info_row_dfs, df_cleaned_data)
+    with stage('compact') as compact_stage:
+        # Measured on the frame the default mode would hand over, which is released right away
+        compact_stage['bytes_before'] = frame_memory(converted_frame(info_row_dfs, df_cleaned_data))
+        df = converted_frame(info_row_dfs, df_cleaned_data, compact=True)
+        compact_stage['bytes_after'] = frame_memory(df)
+    saved = compact_stage['bytes_before'] - compact_stage['bytes_after']
+    print(f"Compact mode: '{os.path.basename(mhtml_file_path)}' held in {compact_stage['bytes_after'] / 1e6:.1f} MB "
+          f"instead of {compact_stage['bytes_before'] / 1e6:.1f} MB in default mode ({saved / 1e6:.1f} MB saved).")
+    return df
+
 # --- Example Usage ---
 if __name__ == "__main__":
     input_mhtml_file = "AOP Automation Scripts/input_data/ZANALYSIS_PATTERN.xls" # Replace with your file
@@ -0,0 +1,156 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pipeline import process_export, report_path_for
+import SAP_File_Automation as file_reader
+
+# --- Configuration ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_OUTPUT_DIR = os.path.join(SCRIPT_DIR, "output_data")
+EXPORT_PATTERN = "*.xls"
+
+# Exit codes for schedulers
+EXIT_OK = 0
+EXIT_FAILURES = 1 # At least one export failed
+EXIT_NO_INPUTS = 2
+
+def expand_inputs(inputs):
+    """
+    Expands files, directories (every *.xls inside) and glob patterns into a sorted, de-duplicated list.
+    """
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.update(glob.glob(os.path.join(item, EXPORT_PATTERN)))
+        elif glob.has_magic(item):
+            paths.update(p for p in glob.glob(item, recursive=True) if os.path.isfile(p))
+        elif os.path.isfile(item):
+            paths.add(item)
+        else:
+            print(f"Warning: '{item}' matched no files.", file=sys.stderr)
+    return sorted(os.path.abspath(p) for p in paths)
+
+def output_dirs_for(input_paths, output_dir):
+    """
+    Returns {input path: directory its report goes to}. Exports whose report names would collide
+    (same file name in different folders) get their folder, relative to the folders they have in
+    common, under output_dir: a/x.xls and b/x.xls -> <output_dir>/a and <output_dir>/b.
+    Exports that would still share a report (x.xls and x.XLS in one folder) map to None.
+    """
+    by_report = {}
+    for path in input_paths:
+        by_report.setdefault(os.path.normcase(report_path_for(path, output_dir)), []).append(path)
+    output_dirs = {}
+    for paths in by_report.values():
+        if len(paths) == 1:
+            output_dirs[paths[0]] = output_dir
+            continue
+        common = os.path.commonpath([os.path.dirname(p) for p in paths])
+        for path in paths:
+            output_dirs[path] = os.path.join(output_dir, os.path.relpath(os.path.dirname(path), common))
+
+    claimed = {}
+    for path, directory in output_dirs.items():
+        claimed.setdefault(os.path.normcase(report_path_for(path, directory)), []).append(path)
+    for paths in claimed.values():
+        if len(paths) > 1:
+            for path in paths:
+                output_dirs[path] = None
+    return output_dirs
+
+def _silence_worker():
+    sys.stdout = open(os.devnull, 'w')
+
+def run_batch(input_paths, output_dir, workers=None, highlight_style='fill', cache_dir=file_reader.PARSE_CACHE_DIR,
+              quiet=False, compact=False):
+    """
+    Processes every export in a process pool and returns the run status dict
+    (per-file results plus files/s and rows/s). See output_dirs_for for where reports go.
+    """
+    start = time.perf_counter()
+    results = []
+    initializer = _silence_worker if quiet else None
+    output_dirs = output_dirs_for(input_paths, output_dir)
+    for path in input_paths:
+        if output_dirs[path] is None: # Never run two exports into one workbook
+            results.append({'input': path, 'output': None, 'status': 'failed', 'rows_in': 0, 'rows_out': 0,
+                            'stage_timings': {}, 'error': "another input in its folder has the same report name"})
+            print(f"Skipping '{path}': another input in its folder has the same report name.", file=sys.stderr)
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer) as executor:
+        futures = {executor.submit(process_export, path, output_dirs[path], highlight_style, cache_dir, compact): path
+                   for path in input_paths if output_dirs[path] is not None}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e: # Worker crashed (e.g. killed for memory)
+                result = {'input': futures[future], 'output': None, 'status': 'failed', 'rows_in': 0,
+                          'rows_out': 0, 'stage_timings': {}, 'error': f"{type(e).__name__}: {e}"}
+            results.append(result)
+            if not quiet:
+                print(f"[{len(results)}/{len(input_paths)}] {result['status']}: {os.path.basename(result['input'])}")
+
+    elapsed = time.perf_counter() - start
+    results.sort(key=lambda r: r['input'])
+    rows = sum(r['rows_in'] for r in results)
+    failed = [r for r in results if r['status'] != 'done']
+    return {
+        'status': 'failed' if failed else 'ok',
+        'files': len(results),
+        'failed': len(failed),
+        'rows': rows,
+        'elapsed_seconds': round(elapsed, 3),
+        'files_per_second': round(len(results) / elapsed, 3) if elapsed else None,
+        'rows_per_second': round(rows / elapsed, 1) if elapsed else None,
+        'output_dir': output_dir,
+        'results': results,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Convert, highlight, trim and pivot SAP ZANALYSIS exports without the GUI.")
+    parser.add_argument('inputs', nargs='+', help="Export files, directories or glob patterns (quote globs)")
+    parser.add_argument('-o', '--output-dir', default=DEFAULT_OUTPUT_DIR,
+                        help="Where <export>_formatted_report.xlsx files are written")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument('--highlight-style', choices=['fill', 'rules'], default='fill')
+    parser.add_argument('--no-cache', action='store_true', help="Always re-parse exports")
+    parser.add_argument('--compact', action='store_true',
+                        help="Hold parsed exports as categoricals/float32 to cut memory on large batches")
+    parser.add_argument('--status-json', metavar='PATH',
+                        help="Write the run status as JSON to PATH ('-' for stdout)")
+    parser.add_argument('-q', '--quiet', action='store_true', help="Suppress per-file log output")
+    args = parser.parse_args(argv)
+
+    input_paths = expand_inputs(args.inputs)
+    if not input_paths:
+        print("Error: no input exports found.", file=sys.stderr)
+        return EXIT_NO_INPUTS
+
+    # JSON on stdout must not be interleaved with log lines
+    quiet = args.quiet or args.status_json == '-'
+    cache_dir = None if args.no_cache else file_reader.PARSE_CACHE_DIR
+    status = run_batch(input_paths, os.path.abspath(args.output_dir), args.workers, args.highlight_style,
+                       cache_dir, quiet, args.compact)
+
+    summary = (f"Processed {status['files']} file(s), {status['rows']} rows in {status['elapsed_seconds']}s "
+               f"({status['files_per_second']} files/s, {status['rows_per_second']} rows/s); "
+               f"{status['failed']} failed.")
+    print(summary, file=sys.stderr if args.status_json == '-' else sys.stdout)
+
+    if args.status_json == '-':
+        json.dump(status, sys.stdout, indent=2)
+        print()
+    elif args.status_json:
+        with open(args.status_json, 'w', encoding='utf-8') as f:
+            json.dump(status, f, indent=2)
+
+    return EXIT_FAILURES if status['failed'] else EXIT_OK
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import argparse
+import contextlib
+import io
+import json
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import SAP_File_Automation as file_reader
+import remove_specified_rows as trimmer
+from generate_sap_export import generate_sap_export
+from instrumentation import RunReport
+
+# --- Configuration ---
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(SCRIPT_DIR, "benchmark_baseline.json")
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "sap_export_benchmarks")
+DEFAULT_SCALES = [1000, 10000, 100000] # 1000000 works too, but takes minutes and a few GB of disk
+DEFAULT_TOLERANCE = 0.25 # A stage more than 25% slower than its baseline is a regression
+MIN_COMPARED_SECONDS = 0.05 # Stages faster than this are too noisy to gate on
+STARTUP_KEY = 'startup' # Results key for the GUI startup timing
+
+# Run in a fresh interpreter: import the GUI, show the window, and exit once it has been painted
+_STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+import GUI
+app = QApplication(sys.argv)
+window = GUI.SearchApp()
+app.processEvents()
+print(time.perf_counter() - start)
+"""
+
+# Benchmark stage -> instrumentation stage it is read from
+REPORTED_STAGES = {
+    'parse': 'parse',
+    'numeric_clean': 'clean_numeric',
+    'classify': 'classify',
+    'write': 'write_report',
+    'rollup': 'rollup', # The aggregation over the export rows
+    'pivot': 'pivot', # Views cut from the rollup cube
+}
+
+def export_for_scale(rows, data_dir):
+    """
+    Generates (once) and returns the synthetic export used for a scale.
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"synthetic_{rows}.xls")
+    if not os.path.exists(path):
+        print(f"Generating {rows} row export...")
+        generate_sap_export(path, rows=rows)
+    return path
+
+def time_extract(export_path):
+    start = time.perf_counter()
+    for _ in file_reader.iter_html_from_mhtml(export_path):
+        pass
+    return time.perf_counter() - start
+
+def run_once(export_path, output_dir):
+    """
+    Runs every stage once on export_path and returns {stage: seconds}.
+    """
+    timings = {'extract': time_extract(export_path)}
+    output_path = os.path.join(output_dir, "benchmark_report.xlsx")
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    log = io.StringIO() # The pipeline's progress prints would drown the results
+    with RunReport(export_path) as report, contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+        converted_df = file_reader.convert_mhtml_to_dataframe(export_path, cache_dir=None)
+        trimmer.apply_conditional_formatting(converted_df, output_path, task='both')
+    measured = report.timings()
+    for name, stage_name in REPORTED_STAGES.items():
+        if stage_name in measured:
+            timings[name] = measured[stage_name]
+    return timings
+
+def time_startup():
+    """
+    Seconds from a fresh interpreter to the GUI window being shown, or None without PyQt5.
+    """
+    if importlib.util.find_spec('PyQt5') is None:
+        return None
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen') # No display needed
+    result = subprocess.run([sys.executable, '-c', _STARTUP_SCRIPT], cwd=SCRIPT_DIR, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"GUI startup benchmark failed:\n{result.stderr}")
+        return None
+    return float(result.stdout.strip().splitlines()[-1])
+
+def run_startup_benchmark(repeat):
+    """
+    Returns {'gui_window_shown': best seconds over `repeat` launches}, or {} without PyQt5.
+    """
+    timings = [t for t in (time_startup() for _ in range(repeat)) if t is not None]
+    if not timings:
+        return {}
+    best = round(min(timings), 4)
+    print(f"  GUI startup: {best:.3f}s to window shown")
+    return {'gui_window_shown': best}
+
+def run_benchmarks(scales, repeat, data_dir):
+    """
+    Returns {rows: {stage: best seconds over `repeat` runs}}.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for rows in scales:
+            export_path = export_for_scale(rows, data_dir)
+            best = {}
+            for _ in range(repeat):
+                for name, seconds in run_once(export_path, output_dir).items():
+                    best[name] = min(seconds, best.get(name, seconds))
+            results[str(rows)] = {name: round(seconds, 4) for name, seconds in best.items()}
+            print(f"{rows:>9} rows: " + ", ".join(f"{name} {seconds:.3f}s" for name, seconds in results[str(rows)].items()))
+    return results
+
+def compare(results, baseline, tolerance):
+    """
+    Prints each stage against its baseline and returns the regressions as strings.
+    """
+    regressions = []
+    for rows, stages in results.items():
+        label = rows if rows == STARTUP_KEY else f"{rows} rows"
+        for name, seconds in stages.items():
+            base = baseline.get(rows, {}).get(name)
+            if base is None:
+                continue
+            ratio = seconds / base if base else float('inf')
+            flag = ""
+            if ratio > 1 + tolerance and max(seconds, base) >= MIN_COMPARED_SECONDS:
+                flag = "  <-- REGRESSION"
+                regressions.append(f"{label} {name}: {base:.3f}s -> {seconds:.3f}s")
+            print(f"{label:>14} {name:<16} {base:8.3f}s -> {seconds:8.3f}s ({ratio:5.2f}x){flag}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time each pipeline stage on synthetic SAP exports.")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_SCALES, help="Row counts to benchmark")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per scale; the fastest is kept")
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help="Where generated exports are kept")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run as the new baseline")
+    parser.add_argument('--no-startup', action='store_true', help="Skip the GUI startup benchmark")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown before a stage counts as a regression (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.rows, args.repeat, args.data_dir)
+    if not args.no_startup:
+        startup = run_startup_benchmark(args.repeat)
+        if startup:
+            results[STARTUP_KEY] = startup
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved baseline to '{args.baseline}'")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at '{args.baseline}'; run with --save-baseline on the reference machine first.")
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} stage(s) regressed by more than {args.tolerance:.0%}:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print("No regressions against the baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
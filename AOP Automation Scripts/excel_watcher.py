@@ -1,97 +1,347 @@
 import time
 import os
-import pandas as pd # For the conversion function
+import json
+import sqlite3
+import threading
+import queue
+import multiprocessing
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from SAP_File_Automation import file_content_hash
+from pipeline import run_export_to_pipe
+from remove_specified_rows import default_ruleset
 
 # --- Configuration ---
 FOLDER_TO_WATCH = "AOP Automation Scripts/input_data"
+OUTPUT_FOLDER = "AOP Automation Scripts/output_data" # Reports are written here as <export>_formatted_report.xlsx
 
-PROCESSED_FILES_LOG = "processed_files.txt" # To keep track of processed files
-
-# --- Helper: Load/Save Processed Files ---
-def load_processed_files():
-    if not os.path.exists(PROCESSED_FILES_LOG):
-        return set()
-    with open(PROCESSED_FILES_LOG, 'r') as f:
-        return set(line.strip() for line in f)
-
-def add_to_processed_files(file_path):
-    with open(PROCESSED_FILES_LOG, 'a') as f:
-        f.write(file_path + "\n")
-
-# --- Conversion Function (same as Part 1) ---
-def xls_to_dataframe(file_path):
-    if not os.path.exists(file_path):
-        print(f"Error: File not found at '{file_path}'")
-        return None
-    if not file_path.lower().endswith('.xls'):
-        # This check might be redundant if the handler filters, but good for direct calls
-        print(f"Error: File '{file_path}' is not a .xls file.")
-        return None
-    try:
-        df = pd.read_excel(file_path, engine='xlrd')
-        print(f"Successfully converted '{os.path.basename(file_path)}' to DataFrame.")
-        return df
-    except ImportError:
-        print("Error: The 'xlrd' library is required for .xls files. "
-              "Please install it: pip install xlrd")
-        return None
-    except Exception as e:
-        print(f"Error converting '{os.path.basename(file_path)}': {e}")
-        return None
+LEDGER_DB = "processed_files.sqlite3" # Ledger of processed files (see ProcessingLedger)
+PROCESSED_FILES_LOG = "processed_files.txt" # Legacy plain-text log, imported once into the ledger
+QUIET_WINDOW_SECONDS = 2.0 # A file must be unchanged (size/mtime, no events) this long before processing
+STABILITY_POLL_SECONDS = 0.25 # How often pending files are re-checked
+WORKER_PROCESSES = os.cpu_count() or 1 # Exports processed in parallel
+QUEUE_SIZE = 64 # Exports waiting for a worker; dispatch blocks beyond this
+FILE_TIMEOUT_SECONDS = 15 * 60 # A worker still running an export after this long is killed
+COMPACT_EXPORTS = False # Hold parsed exports in compact form (categoricals/float32) in the workers
+WORKER_START_METHOD = 'spawn' # Fresh interpreters: forking next to the observer/ledger threads can deadlock a child
+
+# --- Processing Ledger ---
+class ProcessingLedger:
+    """
+    SQLite (WAL) record of every export the watcher has handled: path, size, mtime, content hash,
+    status and stage timings. Skip decisions are made on content hash through indexed lookups,
+    so startup cost does not grow with the history and re-exported files under an old name
+    are processed again.
+    """
+    def __init__(self, db_path=LEDGER_DB):
+        self._lock = threading.Lock()
+        is_new = not os.path.exists(db_path)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS files (
+                content_hash TEXT PRIMARY KEY,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                status TEXT NOT NULL,
+                stage_timings TEXT,
+                updated_at REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS files_path ON files (path)")
+        self._conn.commit()
+        if is_new:
+            self._import_legacy_log()
+
+    def _import_legacy_log(self):
+        # Files listed in the old processed_files.txt are recorded as done, so they are not redone
+        if not os.path.exists(PROCESSED_FILES_LOG):
+            return
+        with open(PROCESSED_FILES_LOG, 'r') as f:
+            legacy_paths = set(line.strip() for line in f if line.strip())
+        imported = 0
+        for file_path in legacy_paths:
+            if os.path.exists(file_path):
+                self.record(file_path, self.fingerprint(file_path), 'done')
+                imported += 1
+        print(f"Imported {imported} of {len(legacy_paths)} entries from '{PROCESSED_FILES_LOG}'.")
+
+    def fingerprint(self, file_path):
+        """
+        Returns (size, mtime, content_hash). The hash is reused from the ledger when the
+        path's size and mtime are unchanged, otherwise the file is hashed.
+        """
+        stat = os.stat(file_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash FROM files WHERE path = ? AND size = ? AND mtime = ?",
+                (file_path, stat.st_size, stat.st_mtime)).fetchone()
+        content_hash = row[0] if row else file_content_hash(file_path)
+        return stat.st_size, stat.st_mtime, content_hash
+
+    def status(self, content_hash):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM files WHERE content_hash = ?", (content_hash,)).fetchone()
+        return row[0] if row else None
+
+    def record(self, file_path, fingerprint, status, stage_timings=None):
+        size, mtime, content_hash = fingerprint
+        timings = json.dumps(stage_timings) if stage_timings is not None else None
+        with self._lock:
+            self._conn.execute(
+                """INSERT INTO files (content_hash, path, size, mtime, status, stage_timings, updated_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(content_hash) DO UPDATE SET
+                       path = excluded.path, size = excluded.size, mtime = excluded.mtime,
+                       status = excluded.status,
+                       stage_timings = COALESCE(excluded.stage_timings, files.stage_timings),
+                       updated_at = excluded.updated_at""",
+                (content_hash, file_path, size, mtime, status, timings, time.time()))
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+# --- Worker Pool ---
+class ExportWorkerPool:
+    """
+    Bounded queue in front of a fixed number of workers running the convert -> classify -> report
+    pipeline. Each export runs in its own child process, so one that hangs past the timeout can be
+    killed without taking the others down. submit() blocks while the queue is full.
+    """
+    def __init__(self, ledger, output_dir=OUTPUT_FOLDER, workers=WORKER_PROCESSES,
+                 queue_size=QUEUE_SIZE, timeout=FILE_TIMEOUT_SECONDS):
+        self.ledger = ledger
+        self.output_dir = output_dir
+        self.timeout = timeout
+        self._mp = multiprocessing.get_context(WORKER_START_METHOD)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._threads = [threading.Thread(target=self._worker_loop, name=f"export-worker-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, file_path, fingerprint):
+        self._queue.put((file_path, fingerprint))
+
+    def drain(self):
+        """
+        Lets queued and running exports finish, then stops the workers.
+        """
+        pending = self._queue.qsize()
+        if pending:
+            print(f"Waiting for {pending} queued export(s) to finish...")
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _worker_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            file_path, fingerprint = item
+            result = self._run(file_path)
+            status = result['status']
+            self.ledger.record(file_path, fingerprint, status, result['stage_timings'])
+            if status == 'done':
+                print(f"Finished {os.path.basename(file_path)}: {result['rows_in']} rows in, "
+                      f"{result['rows_out']} rows out -> '{result['output']}'")
+            else:
+                print(f"Failed to process {os.path.basename(file_path)} ({result['error']}). "
+                      f"It will not be re-attempted automatically by this run.")
+
+    def _run(self, file_path):
+        result = {'status': 'failed', 'stage_timings': {}, 'error': None}
+        receiver, sender = self._mp.Pipe(duplex=False)
+        worker = self._mp.Process(target=run_export_to_pipe, args=(sender, file_path, self.output_dir),
+                                         kwargs={'compact': COMPACT_EXPORTS}, daemon=True)
+        start = time.perf_counter()
+        worker.start()
+        sender.close() # Only the child writes; EOF then means the child died
+        try:
+            if receiver.poll(self.timeout):
+                result = receiver.recv()
+            else:
+                result['status'] = 'timeout'
+                result['error'] = f"no result after {self.timeout}s"
+                worker.terminate()
+        except EOFError:
+            result['error'] = "worker process exited without a result"
+        finally:
+            receiver.close()
+            worker.join()
+        result['stage_timings']['total'] = round(time.perf_counter() - start, 4)
+        return result
 
 # --- File System Event Handler ---
 class ExcelFileHandler(FileSystemEventHandler):
-    def __init__(self, processed_files_set):
+    """
+    Debounces created/modified/moved events per path: a file is dispatched once, as soon as its
+    size and mtime have been stable (and no new events arrived) for quiet_window seconds.
+    The stability checks run on a separate thread so the observer thread never blocks.
+    """
+    def __init__(self, ledger, pool, quiet_window=QUIET_WINDOW_SECONDS, poll_interval=STABILITY_POLL_SECONDS):
         super().__init__()
-        self.processed_files = processed_files_set
+        self.ledger = ledger
+        self.pool = pool
+        self.attempted = set() # Content hashes tried during this run, including failures
+        self._attempted_lock = threading.Lock() # The backlog scan and the debounce thread both dispatch
+        self.quiet_window = quiet_window
+        self.poll_interval = poll_interval
+        self._pending = {} # path -> {'event': last event time, 'stat': (size, mtime), 'stable_since': time}
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._debounce_thread = None
+
+    def start(self):
+        self._debounce_thread = threading.Thread(target=self._debounce_loop, name="xls-debounce", daemon=True)
+        self._debounce_thread.start()
+
+    def stop(self):
+        """
+        Stops the stability checks; files still being written are left for the next start.
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._debounce_thread is not None:
+            self._debounce_thread.join()
+
+    @staticmethod
+    def _is_export(file_path):
+        return file_path.lower().endswith('.xls')
+
+    def _note_event(self, file_path):
+        with self._cond:
+            entry = self._pending.setdefault(file_path, {'stat': None, 'stable_since': None})
+            entry['event'] = time.monotonic()
+            self._cond.notify()
 
     def on_created(self, event):
         """
         Called when a file or directory is created.
         """
+        if not event.is_directory and self._is_export(event.src_path):
+            self._note_event(event.src_path)
+
+    def on_modified(self, event):
+        if not event.is_directory and self._is_export(event.src_path):
+            self._note_event(event.src_path)
+
+    def on_moved(self, event):
+        # Browsers and SAP GUI often download to a temporary name and rename when done
         if event.is_directory:
-            return  # Ignore directory creation events
+            return
+        with self._cond:
+            self._pending.pop(event.src_path, None)
+        if self._is_export(event.dest_path):
+            self._note_event(event.dest_path)
+
+    def _check_ready(self, file_path, entry, now):
+        """
+        Returns True when the file is complete, None if it disappeared, otherwise False.
+        """
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return None
+        except OSError:
+            return False
+        current = (stat.st_size, stat.st_mtime)
+        if current != entry['stat']:
+            entry['stat'] = current
+            entry['stable_since'] = now
+            return False
+        if now - entry['stable_since'] < self.quiet_window or now - entry['event'] < self.quiet_window:
+            return False
+        try:
+            with open(file_path, 'rb'): # Still locked by the writer on Windows
+                pass
+        except OSError:
+            return False
+        return True
 
-        file_path = event.src_path
-        if file_path.lower().endswith('.xls'):
-            # Check if it's already processed (e.g., if script restarted quickly)
-            # Or if multiple events fire for the same file creation (can happen)
-            time.sleep(1) # Wait a bit for the file to be fully written
+    def _debounce_loop(self):
+        while True:
+            with self._cond:
+                if self._stopping:
+                    return
+                if not self._pending:
+                    self._cond.wait()
+                    continue
+                self._cond.wait(self.poll_interval)
+                if self._stopping:
+                    return
+                snapshot = [(path, dict(entry)) for path, entry in self._pending.items()]
+
+            now = time.monotonic()
+            ready = []
+            for file_path, entry in snapshot:
+                state = self._check_ready(file_path, entry, now)
+                with self._cond:
+                    current = self._pending.get(file_path)
+                    if current is None or current['event'] != entry['event']:
+                        continue # A newer event arrived while checking; look again next round
+                    if state is None:
+                        del self._pending[file_path]
+                    elif state:
+                        del self._pending[file_path]
+                        ready.append(file_path)
+                    else:
+                        current['stat'] = entry['stat']
+                        current['stable_since'] = entry['stable_since']
+
+            for file_path in ready:
+                self.dispatch_file(file_path)
+
+    def refresh_rules(self):
+        """
+        Checks keyword_groups.json before dispatching, to report changed or broken rules. The export
+        workers are fresh processes that load the rules themselves (Ruleset.matchers refreshes
+        before classifying), so edits saved from the GUI apply to the next export.
+        """
+        previous_rules = default_ruleset.digest
+        try:
+            default_ruleset.refresh()
+        except Exception as e:
+            print(f"Could not load the keyword rules: {e}") # The worker reports the failure for the export
+            return
+        if previous_rules is not None and default_ruleset.digest != previous_rules:
+            print("Keyword rules changed; new exports use the updated rules.")
 
-            # A more robust check for file readiness might be needed on some systems
-            # e.g., try to open in exclusive mode, or check file size stability.
-            # For simplicity, a small delay is often sufficient.
+    def dispatch_file(self, file_path, report_skips=True):
+        """
+        Queues the file for the worker pool unless the ledger already has its content.
+        Blocks while the queue is full, which holds back further dispatches.
+        """
+        try:
+            fingerprint = self.ledger.fingerprint(file_path)
+        except OSError as e:
+            print(f"Could not read '{os.path.basename(file_path)}': {e}")
+            return
 
-            if file_path in self.processed_files:
+        # Skip on content, not name: a re-export under an old name is new work
+        content_hash = fingerprint[2]
+        with self._attempted_lock:
+            already_seen = content_hash in self.attempted or self.ledger.status(content_hash) == 'done'
+            # Mark as attempted immediately to prevent reprocessing by duplicate events
+            self.attempted.add(content_hash)
+        if already_seen:
+            if report_skips:
                 print(f"File '{os.path.basename(file_path)}' already processed or processing initiated. Skipping.")
-                return
+            return
 
-            # Add to processed set immediately to prevent reprocessing by other events/restarts
-            self.processed_files.add(file_path)
-            # Log it to disk after successful processing attempt (or before, depending on strategy)
-
-            print(f"New .xls file detected: {os.path.basename(file_path)}")
-            df = xls_to_dataframe(file_path)
-
-            if df is not None:
-                print(f"--- DataFrame from {os.path.basename(file_path)} ---")
-                print(df.head())
-                # --- DO SOMETHING WITH THE DATAFRAME HERE ---
-                # e.g., save to CSV, database, further processing, etc.
-                # output_csv = os.path.splitext(file_path)[0] + ".csv"
-                # df.to_csv(output_csv, index=False)
-                # print(f"Saved DataFrame to {output_csv}")
-                # ---------------------------------------------
-                add_to_processed_files(file_path) # Log after successful processing
-            else:
-                # If conversion failed, perhaps remove from processed_files if you want to retry later?
-                # For now, we assume a failed conversion is still "processed" in terms of attempt.
-                # Or, you could remove it from self.processed_files if retry is desired.
-                # self.processed_files.remove(file_path)
-                print(f"Failed to process {os.path.basename(file_path)}. It will not be re-attempted automatically by this run.")
-                # If you want to log failed attempts to a different file, do so here.
+        self.ledger.record(file_path, fingerprint, 'queued')
+        print(f"New .xls file detected: {os.path.basename(file_path)}")
+        self.refresh_rules()
+        self.pool.submit(file_path, fingerprint)
 
 
 # --- Main Watcher Function ---
@@ -106,40 +356,38 @@ def start_watching(folder_path):
             print(f"Could not create directory '{folder_path}': {e}")
             return
 
-    processed_files_set = load_processed_files()
-    print(f"Loaded {len(processed_files_set)} previously processed files.")
-
-    # Initial scan for existing .xls files that haven't been processed
-    print(f"Performing initial scan of '{folder_path}'...")
-    for filename in os.listdir(folder_path):
-        if filename.lower().endswith('.xls'):
-            full_path = os.path.join(folder_path, filename)
-            if full_path not in processed_files_set:
-                print(f"Found unprocessed existing file: {filename}. Processing now.")
-                # Simulate an event for consistency
-                mock_event = type('Event', (object,), {'src_path': full_path, 'is_directory': False})
-                handler_instance = ExcelFileHandler(processed_files_set) # Create instance to call method
-                handler_instance.on_created(mock_event) # Call the handler method
-
-
-    event_handler = ExcelFileHandler(processed_files_set)
+    ledger = ProcessingLedger()
+    pool = ExportWorkerPool(ledger)
+    event_handler = ExcelFileHandler(ledger, pool)
     observer = Observer()
     observer.schedule(event_handler, folder_path, recursive=False) # Set recursive=True to watch subfolders
 
-    print(f"Watching folder: {folder_path} for new .xls files...")
+    # Start watching before the backlog scan so drops made meanwhile are not missed
+    pool.start()
+    event_handler.start()
     observer.start()
 
     try:
+        # Initial scan for existing .xls files; they are queued and processed in parallel
+        print(f"Performing initial scan of '{folder_path}'...")
+        for filename in os.listdir(folder_path):
+            if filename.lower().endswith('.xls'):
+                # Files already in the ledger are skipped quietly; no write-completion wait is needed
+                event_handler.dispatch_file(os.path.join(folder_path, filename), report_skips=False)
+
+        print(f"Watching folder: {folder_path} for new .xls files...")
         while True:
             time.sleep(5) # Keep the main thread alive, check for observer health if needed
     except KeyboardInterrupt:
         print("Watcher stopped by user.")
-        observer.stop()
     except Exception as e:
         print(f"An error occurred in the watcher: {e}")
-        observer.stop()
     finally:
+        observer.stop()
         observer.join()
+        event_handler.stop()
+        pool.drain()
+        ledger.close()
         print("Observer shut down.")
 
 
@@ -151,12 +399,13 @@ if __name__ == "__main__":
          print("!!! Edit the script and change '/path/to/your/excel_files' to a real path.!!!")
          print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
     else:
-        # Ensure xlrd and pandas are installed for the conversion
+        # Ensure the pipeline's libraries are installed
         try:
             import pandas
-            import xlrd
+            import lxml
+            import openpyxl
         except ImportError as ie:
             print(f"Missing required library: {ie}. Please install it.")
-            print("Try: pip install pandas xlrd watchdog")
+            print("Try: pip install pandas lxml openpyxl watchdog")
         else:
             start_watching(FOLDER_TO_WATCH)
\ No newline at end of file
@@ -0,0 +1,150 @@
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+from openpyxl.formatting.rule import FormulaRule
+from openpyxl.utils import get_column_letter
+
+import SAP_File_Automation as file_reader
+from remove_specified_rows import ROW_FILLS, open_report_writer
+from rollup import CUBE_LEVELS, monthly_values
+from instrumentation import stage
+from progress import report_progress, scaled_progress
+
+# --- Configuration ---
+DIFF_SHEET = 'Diff'
+DIFF_SUMMARY_SHEET = 'Diff Summary'
+DIFF_KEYS = list(CUBE_LEVELS) # Legal Name, Pkg, PDL (the Sold-To column is not kept by the parser)
+OCCURRENCE_COLUMN = '#' # Tells apart rows that share a key, in export order
+DIFF_MEASURE = 'Demand' # Monthly measures compared and reported as deltas
+STATUS_ORDER = ['changed', 'added', 'removed']
+STATUS_FILLS = {'changed': ROW_FILLS['yellow'], 'added': ROW_FILLS['green'], 'removed': ROW_FILLS['red']}
+
+def keyed_months(df : pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per export row: the join keys, an occurrence number per key, and the DIFF_MEASURE
+    values of its month bands (weekly bands are not compared, see rollup.monthly_values).
+    """
+    months = monthly_values(df)
+    months = months[[label for label in months.columns if label.endswith(DIFF_MEASURE)]]
+    body = df.iloc[1:]
+    keys = pd.DataFrame({level: body.iloc[:, position].astype(str).str.strip().to_numpy()
+                         for level, position in CUBE_LEVELS.items()}, index=body.index)
+    keys[OCCURRENCE_COLUMN] = keys.groupby(DIFF_KEYS, sort=False).cumcount()
+    return pd.concat([keys, months], axis=1)
+
+def compare_exports(current_df : pd.DataFrame, previous_df : pd.DataFrame):
+    """
+    Joins two converted exports on (Legal Name, Pkg, PDL, occurrence) and returns (diff, months):
+    one row per added, removed or changed row with its per-month DIFF_MEASURE delta (current minus
+    previous), and the month bands both exports have, which are the only ones compared.
+    """
+    current = keyed_months(current_df)
+    previous = keyed_months(previous_df)
+    join_keys = DIFF_KEYS + [OCCURRENCE_COLUMN]
+    months = [label for label in current.columns[len(join_keys):] if label in previous.columns]
+
+    # One hash join on the keys; the indicator says which side(s) each row came from
+    joined = current[join_keys + months].merge(previous[join_keys + months], on=join_keys, how='outer',
+                                               suffixes=('', ' (previous)'), indicator=True, sort=False)
+    current_values = joined[months].fillna(0).to_numpy(dtype=float)
+    previous_values = joined[[f"{m} (previous)" for m in months]].fillna(0).to_numpy(dtype=float)
+    deltas = current_values - previous_values
+
+    side = joined['_merge'].to_numpy()
+    changed = (deltas != 0).any(axis=1) if months else np.zeros(len(joined), dtype=bool)
+    status = np.select([side == 'left_only', side == 'right_only', changed], ['added', 'removed', 'changed'],
+                       default='unchanged')
+
+    diff = pd.DataFrame(deltas, columns=[f"{m} Δ" for m in months])
+    diff.insert(0, 'Status', status)
+    for position, level in enumerate(join_keys, 1):
+        diff.insert(position, level, joined[level].to_numpy())
+    diff['Total Δ'] = deltas.sum(axis=1)
+    return diff, months
+
+def summarize_diff(diff : pd.DataFrame, months : list) -> dict:
+    counts = diff['Status'].value_counts()
+    return {
+        'added': int(counts.get('added', 0)),
+        'removed': int(counts.get('removed', 0)),
+        'changed': int(counts.get('changed', 0)),
+        'unchanged': int(counts.get('unchanged', 0)),
+        'month_deltas': {m: float(diff[f"{m} Δ"].sum()) for m in months},
+    }
+
+def write_diff(writer, diff : pd.DataFrame, summary : dict):
+    """
+    Writes the changed/added/removed rows (status colors via conditional formatting, so the cost
+    does not grow with the number of rows) and the per-month totals to an open writer.
+    """
+    rows = diff[diff['Status'] != 'unchanged'].copy()
+    rows['Status'] = pd.Categorical(rows['Status'], categories=STATUS_ORDER, ordered=True)
+    rows = rows.sort_values(['Status'] + DIFF_KEYS + [OCCURRENCE_COLUMN], kind='stable')
+    rows.to_excel(writer, sheet_name=DIFF_SHEET, index=False)
+    ws = writer.sheets[DIFF_SHEET]
+    ws.freeze_panes = 'B2'
+    if len(rows):
+        data_range = f"A2:{get_column_letter(rows.shape[1])}{len(rows) + 1}"
+        for status, fill in STATUS_FILLS.items():
+            ws.conditional_formatting.add(data_range, FormulaRule(formula=[f'$A2="{status}"'], fill=fill))
+
+    counts = pd.DataFrame({'Rows': [summary[s] for s in STATUS_ORDER + ['unchanged']]},
+                          index=pd.Index(STATUS_ORDER + ['unchanged'], name='Status'))
+    counts.to_excel(writer, sheet_name=DIFF_SUMMARY_SHEET)
+    month_totals = pd.DataFrame({f"{DIFF_MEASURE} Δ": summary['month_deltas']})
+    month_totals.index.name = 'Month'
+    month_totals.to_excel(writer, sheet_name=DIFF_SUMMARY_SHEET, startrow=len(counts) + 2)
+
+def diff_exports(current_path, previous_path, output_excel_path, cache_dir=file_reader.PARSE_CACHE_DIR,
+                 progress_callback=None):
+    """
+    Parses both SAP exports (through the parse cache), compares them and writes the 'Diff' and
+    'Diff Summary' sheets to output_excel_path (added to the report if it already exists).
+    Returns the summary dict (row counts per status and total delta per month), or None on failure.
+    """
+    parsed = []
+    for step, path in enumerate((current_path, previous_path)):
+        df = file_reader.convert_mhtml_to_dataframe(path, cache_dir=cache_dir,
+                                                    progress_callback=scaled_progress(progress_callback, 40 * step, 40 * step + 40))
+        if df is None:
+            print(f"Error: Could not parse '{path}'.")
+            return None
+        parsed.append(df)
+
+    with stage('diff', rows_in=file_reader.body_row_count(parsed[0]) + file_reader.body_row_count(parsed[1])) as diff_stage:
+        diff, months = compare_exports(*parsed)
+        summary = summarize_diff(diff, months)
+        diff_stage['rows_out'] = len(diff) - summary['unchanged']
+    report_progress(progress_callback, 85)
+    if not months:
+        print("Warning: The exports share no month bands; only added and removed rows are reported.")
+
+    try:
+        with stage('write_diff', written_path=output_excel_path), \
+                open_report_writer(output_excel_path, replace_sheets=(DIFF_SHEET, DIFF_SUMMARY_SHEET)) as writer:
+            write_diff(writer, diff, summary)
+    except Exception as e:
+        print(f"Error writing the diff: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+    report_progress(progress_callback, 100)
+    print(f"Diff: {summary['added']} added, {summary['removed']} removed, {summary['changed']} changed, "
+          f"{summary['unchanged']} unchanged rows. Written to '{output_excel_path}'")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a SAP export with the previous one.")
+    parser.add_argument('current', help="The new export (.xls)")
+    parser.add_argument('previous', help="The export to compare against, e.g. input_data/test_PREV.xls")
+    parser.add_argument('-o', '--output', default=None,
+                        help="Workbook to write the diff sheets to (default: <current>_diff.xlsx next to it)")
+    parser.add_argument('--no-cache', action='store_true', help="Parse both exports from scratch")
+    args = parser.parse_args()
+    output = args.output or os.path.splitext(args.current)[0] + "_diff.xlsx"
+    result = diff_exports(args.current, args.previous, output, cache_dir=None if args.no_cache else file_reader.PARSE_CACHE_DIR)
+    sys.exit(0 if result is not None else 1)
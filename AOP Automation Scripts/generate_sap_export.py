@@ -0,0 +1,154 @@
+import argparse
+import binascii
+import json
+import random
+
+# --- Configuration ---
+# Shape of a synthetic ZANALYSIS export: MHTML wrapping an Excel 2003 HTML table styled like the
+# real ones (x0 title, x1/x2/x3 headers, x4/x5 alternating body rows). Used for benchmarks.
+MONTH_NAMES = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+PLANT_CODES = ['C3', 'JB', 'JH', 'JL', 'K3', 'K4', 'K5', 'P3', 'P4', 'V1']
+
+# Package part of the Profit Center, weighted roughly like the sample exports
+DEFAULT_PACKAGE_WEIGHTS = {
+    'CABGA': 20, 'Test': 15, 'TEST ONLY': 6, 'Test Only': 4, 'SIP': 6, 'SCSP MEMORY': 4,
+    'PBGA': 6, 'FPS': 3, 'SCSP': 3, 'Molded MEMS': 2, 'CABGA MEMORY': 1, 'SIP RF': 1, 'SIP RF Test': 1,
+}
+
+SNAPSHOT_SERIAL = 45805 # Excel serial of the snapshot date below
+SNAPSHOT_DATE = "05/28/2025"
+ROWS_PER_WRITE = 500 # Body rows encoded and written per step
+
+_STYLE_SHEET = """<style> br{mso-data-placement:same-cell;}
+.x4\t\t\t{text-align:right;vertical-align:middle;background:#ffffff;border-bottom:1.0pt solid #aeaeae;border-top:1.0pt solid #aeaeae;border-left:1.0pt solid #aeaeae;border-right:1.0pt solid #aeaeae;padding-left:3.0pt;padding-right:3.0pt;padding-top:3.0pt;padding-bottom:3.0pt;mso-char-indent-count:0; color:#000000; font-size:8.0pt; font-family:Arial;}
+.x2\t\t\t{text-align:right;vertical-align:middle;background:#c6c4c4;border-bottom:1.0pt solid #aeaeae;border-top:1.0pt solid #aeaeae;border-left:1.0pt solid #aeaeae;border-right:1.0pt solid #aeaeae;padding-left:3.0pt;padding-right:3.0pt;padding-top:3.0pt;padding-bottom:3.0pt;mso-char-indent-count:0; color:#000000; font-size:8.0pt; font-family:Arial;}
+.x0\t\t\t{background:#ffffff;padding-left:3.0pt;padding-right:3.0pt;padding-top:3.0pt;padding-bottom:3.0pt;mso-char-indent-count:0; color:#000000; font-size:8.0pt; font-family:Arial; font-weight:700;}
+.x3\t\t\t{text-align:left;vertical-align:middle;background:#c6c4c4;border-bottom:1.0pt solid #aeaeae;border-top:1.0pt solid #aeaeae;border-left:1.0pt solid #aeaeae;border-right:1.0pt solid #aeaeae;padding-left:3.0pt;padding-right:3.0pt;padding-top:3.0pt;padding-bottom:3.0pt;mso-char-indent-count:0; color:#000000; font-size:8.0pt; font-family:Arial;}
+.x5\t\t\t{text-align:right;vertical-align:middle;background:#e9eef4;border-bottom:1.0pt solid #aeaeae;border-top:1.0pt solid #aeaeae;border-left:1.0pt solid #aeaeae;border-right:1.0pt solid #aeaeae;padding-left:3.0pt;padding-right:3.0pt;padding-top:3.0pt;padding-bottom:3.0pt;mso-char-indent-count:0; color:#000000; font-size:8.0pt; font-family:Arial;}
+.x1\t\t\t{text-align:left;vertical-align:middle;background:#c6c4c4;border-bottom:1.0pt solid #aeaeae;border-top:1.0pt solid #aeaeae;border-left:1.0pt solid #aeaeae;border-right:1.0pt solid #aeaeae;padding-left:3.0pt;padding-right:3.0pt;padding-top:3.0pt;padding-bottom:3.0pt;mso-char-indent-count:0;}
+</style>"""
+
+_TEXT_FORMAT = "mso-number-format:'\\@'"
+_BLANK_NUMBER = "<td class={cls} style=\" mso-number-format:'General'\"></td>\n"
+_NUMBER = "<td class={cls} x:num=\"{value:.1f}\" style=\" mso-number-format:'#,##0;-#,##0;#,##0;\\@'\">{value:,.0f}</td>\n"
+
+def _html_text(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace(' ', '&#32;')
+
+def _text_cell(text, cls='x3', colspan=1):
+    span = f" colspan={colspan}" if colspan > 1 else ""
+    return f"<td class={cls}{span} style=\" {_TEXT_FORMAT};\">{_html_text(text)}</td>\n"
+
+def measure_labels(weeks, months, first_week=22, first_month=7, year=2025):
+    """
+    Column band labels: `weeks` weekly buckets, then `months` monthly buckets (first_month is 0-based).
+    """
+    labels = [f"{first_week + i}/{year} Unit Starts" for i in range(weeks)]
+    for i in range(months):
+        month_year = year + (first_month + i) // 12
+        labels.append(f"{MONTH_NAMES[(first_month + i) % 12]} {month_year} Unit Starts")
+    return labels
+
+def _header_rows(labels):
+    band = [_text_cell('', 'x1', colspan=7), _text_cell('', 'x2')]
+    fields = [_text_cell('Forecast Type'), _text_cell('Snapshot Date'), _text_cell('Parent Customer', colspan=2),
+              _text_cell('Profit Center', colspan=2), _text_cell('PDL'), _text_cell('', 'x2')]
+    for label in labels:
+        band += [_text_cell(label), _text_cell(label)]
+        fields += [_text_cell('Demand'), _text_cell('Commit')]
+    return "<tr>\n" + "".join(band) + "</tr>\n<tr>\n" + "".join(fields) + "</tr>\n"
+
+def _body_rows(rng, rows, n_measures, customers, package_weights, empty_ratio):
+    """
+    Yields body rows sorted by customer and profit center, as SAP sorts them, so the red/green
+    context that Test rows depend on looks like a real export.
+    """
+    packages = list(package_weights)
+    weights = [package_weights[p] for p in packages]
+    keys = []
+    for _ in range(rows):
+        customer = rng.randrange(customers)
+        plant = rng.choice(PLANT_CODES)
+        package = rng.choices(packages, weights)[0]
+        pdl = f"{rng.choice('123456789ABCGJQTV')}{rng.choice('ABHJKPQRTV')}  {rng.randrange(1, 50):02d}  {rng.randrange(16, 700):03d}"
+        keys.append((customer, plant, package, pdl))
+    keys.sort()
+
+    for row_number, (customer, plant, package, pdl) in enumerate(keys):
+        cls = 'x4' if row_number % 2 == 0 else 'x5'
+        cells = [
+            _text_cell('Daily Cut-off'),
+            f"<td class=x3 x:num=\"{SNAPSHOT_SERIAL}\" style=\" mso-number-format:'MM/dd/yyyy'\">{SNAPSHOT_DATE}</td>\n",
+            _text_cell(str(10000 + customer)),
+            _text_cell(f"CUSTOMER {customer:05d} INC."),
+            _text_cell(f"{plant}{rng.randrange(10000, 99999)}"),
+            _text_cell(f"{plant} {package}"),
+            _text_cell(pdl),
+            _text_cell(pdl),
+        ]
+        for _ in range(n_measures):
+            if rng.random() < empty_ratio:
+                cells += [_BLANK_NUMBER.format(cls=cls)] * 2
+            else:
+                value = float(rng.randrange(1, 100000))
+                cells += [_NUMBER.format(cls=cls, value=value)] * 2 # Demand, Commit
+        yield "<tr>\n" + "".join(cells) + "</tr>\n"
+
+def generate_sap_export(output_path, rows=1000, weeks=9, months=6, customers=None, package_weights=None,
+                        empty_ratio=0.4, seed=0):
+    """
+    Writes a synthetic ZANALYSIS export (MHTML, quoted-printable HTML) with `rows` body rows and
+    weeks + months Demand/Commit column pairs. Returns output_path.
+    """
+    rng = random.Random(seed)
+    customers = customers or max(1, rows // 12)
+    package_weights = package_weights or DEFAULT_PACKAGE_WEIGHTS
+    labels = measure_labels(weeks, months)
+
+    head = (
+        "<html xmlns:v=\"urn:schemas-microsoft-com:vml\"\nxmlns:o=\"urn:schemas-microsoft-com:office:office\"\n"
+        "xmlns:x=\"urn:schemas-microsoft-com:office:excel\"\nxmlns=\"http://www.w3.org/TR/REC-html40\">\n\n<head>\n"
+        "<meta name=\"Excel Workbook Frameset\">\n<meta http-equiv=Content-Type content=\"text/html; charset=UTF-8\">\n"
+        "<meta name=ProgId content=Excel.Sheet>\n<meta name=Generator content=\"Microsoft Excel 11\">\n"
+        + _STYLE_SHEET + "\n</head>\n<body>\n"
+        "<table><tr><td>&#160;</td></tr></table><table>\n<tr>\n"
+        + _text_cell('Sales Forecast Report', 'x0') +
+        "</tr>\n</table>\n<table><tr><td>&#160;</td></tr></table><table>\n"
+        + _header_rows(labels)
+    )
+
+    def qp(text):
+        return binascii.b2a_qp(text.encode('utf-8'))
+
+    with open(output_path, 'wb') as f:
+        f.write(b"MIME-Version: 1.0\nX-Document-Type: Worksheet\n"
+                b"Content-Type: multipart/related; boundary=\"NEXTMIME\"\n\n\n--NEXTMIME\n"
+                b"Content-Location: file:///C:/abc/Doc.htm\nContent-Transfer-Encoding: quoted-printable\n"
+                b"Content-Type: text/html; charset=\"UTF-8\"\n\n")
+        f.write(qp(head))
+        batch = []
+        for row in _body_rows(rng, rows, len(labels), customers, package_weights, empty_ratio):
+            batch.append(row)
+            if len(batch) == ROWS_PER_WRITE:
+                f.write(qp("".join(batch)))
+                batch = []
+        f.write(qp("".join(batch) + "</table>\n</body>\n</html>\n"))
+        f.write(b"\n--NEXTMIME--\n")
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic SAP ZANALYSIS export for benchmarking.")
+    parser.add_argument('output', help="Path of the .xls file to write")
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--weeks', type=int, default=9, help="Weekly Demand/Commit column pairs")
+    parser.add_argument('--months', type=int, default=6, help="Monthly Demand/Commit column pairs")
+    parser.add_argument('--customers', type=int, default=None, help="Distinct customers (default: rows / 12)")
+    parser.add_argument('--empty-ratio', type=float, default=0.4, help="Share of blank measure pairs")
+    parser.add_argument('--package-weights', type=json.loads, default=None,
+                        help='JSON object of Profit Center package -> weight, e.g. \'{"CABGA": 3, "Test": 1}\'')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    generate_sap_export(args.output, args.rows, args.weeks, args.months, args.customers, args.package_weights,
+                        empty_ratio=args.empty_ratio, seed=args.seed)
+    print(f"Wrote {args.rows} rows to '{args.output}'")
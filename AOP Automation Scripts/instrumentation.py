@@ -0,0 +1,138 @@
+import contextvars
+import functools
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource # POSIX only
+except ImportError:
+    resource = None
+
+try:
+    import psutil # Optional: peak memory on Windows
+except ImportError:
+    psutil = None
+
+# --- Configuration ---
+RUN_REPORT_SUFFIX = ".run.json" # formatted_report.xlsx -> formatted_report.run.json
+
+_active_report = contextvars.ContextVar('active_run_report', default=None)
+
+def peak_rss_mb():
+    """
+    Peak resident memory of this process so far in MB, or None if it can't be measured.
+    """
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1) # bytes on macOS, KB elsewhere
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / (1024 * 1024), 1)
+    return None
+
+class RunReport:
+    """
+    Collects one record per pipeline stage: wall and CPU seconds, rows in/out, bytes read/written
+    and peak RSS. Activate it with `with report:`; stage() blocks anywhere below then record into it.
+    """
+    def __init__(self, input_path=None):
+        self.input_path = input_path
+        self.output_path = None
+        self.started = time.time()
+        self.finished = None
+        self.stages = []
+        self._token = None
+
+    def __enter__(self):
+        self._token = _active_report.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _active_report.reset(self._token)
+        self.finished = time.time()
+        return False
+
+    def timings(self):
+        timings = {}
+        for record in self.stages:
+            timings[record['stage']] = round(timings.get(record['stage'], 0) + record['wall_seconds'], 4)
+        return timings
+
+    def to_dict(self):
+        return {
+            'input': self.input_path,
+            'output': self.output_path,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'wall_seconds': round((self.finished or time.time()) - self.started, 4),
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': self.stages,
+        }
+
+    def write(self, output_excel_path):
+        """
+        Writes the report as JSON next to the output workbook and returns its path.
+        """
+        self.output_path = output_excel_path
+        report_path = os.path.splitext(output_excel_path)[0] + RUN_REPORT_SUFFIX
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        return report_path
+
+    def summary(self):
+        """
+        One line per stage, for logs and the GUI.
+        """
+        lines = []
+        for r in self.stages:
+            line = f"{r['stage']}: {r['wall_seconds']:.2f}s wall, {r['cpu_seconds']:.2f}s CPU"
+            if r.get('rows_in') is not None or r.get('rows_out') is not None:
+                line += f", rows {r.get('rows_in', '-')} -> {r.get('rows_out', '-')}"
+            if r.get('bytes_read'):
+                line += f", {r['bytes_read'] / (1024 * 1024):.1f} MB read"
+            if r.get('bytes_written'):
+                line += f", {r['bytes_written'] / (1024 * 1024):.1f} MB written"
+            lines.append(line)
+        peak = peak_rss_mb()
+        if peak is not None:
+            lines.append(f"peak memory: {peak:.0f} MB")
+        return lines
+
+@contextmanager
+def stage(name, **fields):
+    """
+    Times the enclosed block as a stage of the active RunReport (a no-op without one).
+    Yields the stage record, so the block can fill in rows_out, bytes_written, etc.
+    With written_path=<file>, bytes_written is taken from that file once the block is done.
+    """
+    report = _active_report.get()
+    record = {'stage': name, **fields}
+    if report is None:
+        yield record
+        return
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        yield record
+    finally:
+        written_path = record.pop('written_path', None)
+        if written_path and os.path.exists(written_path):
+            record['bytes_written'] = os.path.getsize(written_path)
+        record['wall_seconds'] = round(time.perf_counter() - wall_start, 4)
+        record['cpu_seconds'] = round(time.process_time() - cpu_start, 4)
+        record['peak_rss_mb'] = peak_rss_mb()
+        report.stages.append(record)
+
+def instrumented(name):
+    """
+    Decorator form of stage() for functions that are a stage on their own.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+
+# --- Configuration ---
+# Paths are resolved from this file, so the scripts work from any working directory.
+INPUT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "input_data")
+KEYWORD_GROUPS_PATH = os.path.join(INPUT_DATA_DIR, "keyword_groups.json")
+KEYWORD_GROUPS_DEFAULT_PATH = os.path.join(INPUT_DATA_DIR, "keyword_groups_default.json")
+KEYWORD_GROUP_NAMES = ['red', 'green', 'red_complex', 'green_complex']
+
+_keyword_groups_cache = {} # path -> (file stamp, groups)
+
+def keyword_file_stamp(path):
+    """
+    Cheap change check for a rules file: (mtime_ns, size), or None if it doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+def keyword_groups_digest(groups):
+    """
+    Hash of the rules themselves, so a re-saved but unchanged file is recognised as unchanged.
+    """
+    canonical = json.dumps([groups.get(name, []) for name in KEYWORD_GROUP_NAMES])
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def load_keyword_groups(path=KEYWORD_GROUPS_PATH):
+    """
+    Returns the keyword groups in path as {'red': [...], 'green': [...], 'red_complex': [...],
+    'green_complex': [...]}. The file is only re-read when its mtime or size has changed since the last call.
+    """
+    stamp = keyword_file_stamp(path)
+    cached = _keyword_groups_cache.get(path)
+    if cached is not None and stamp is not None and cached[0] == stamp:
+        return cached[1]
+    with open(path, "r", encoding="utf-8") as f:
+        loaded = json.load(f)
+    groups = {name: list(loaded.get(name, [])) for name in KEYWORD_GROUP_NAMES}
+    _keyword_groups_cache[path] = (stamp, groups)
+    return groups
+
+def save_keyword_groups(groups, path=KEYWORD_GROUPS_PATH):
+    """
+    Writes the keyword groups to path and makes them the cached copy. The file is written next to
+    path and then swapped in, so a reader never sees it half written.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(groups, f, indent=2)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _keyword_groups_cache[path] = (keyword_file_stamp(path),
+                                   {name: list(groups.get(name, [])) for name in KEYWORD_GROUP_NAMES})
+
+def clear_keyword_groups_cache():
+    _keyword_groups_cache.clear()
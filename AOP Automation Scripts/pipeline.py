@@ -0,0 +1,84 @@
+import os
+import signal
+import traceback
+
+import SAP_File_Automation as file_reader
+import remove_specified_rows as trimmer
+from instrumentation import RunReport
+
+# --- Configuration ---
+REPORT_SUFFIX = "_formatted_report.xlsx"
+
+# --- Pipeline ---
+def report_path_for(input_path, output_dir):
+    """
+    Output workbook for an export: <output_dir>/<export name>_formatted_report.xlsx
+    """
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(output_dir, stem + REPORT_SUFFIX)
+
+def process_export(input_path, output_dir, highlight_style='fill', cache_dir=file_reader.PARSE_CACHE_DIR, compact=False):
+    """
+    Runs convert -> classify -> report for one SAP export and writes the highlight and remove
+    sheets to report_path_for(input_path, output_dir), with its JSON run report next to it.
+    Returns a plain dict (safe to send between processes) with status 'done' or 'failed',
+    row counts, per-stage timings and the run report path.
+    compact holds the parsed export in its compact form (see SAP_File_Automation.compact_frame).
+    Numeric cleaning stays in this process: callers already run one export per worker.
+    """
+    result = {
+        'input': input_path,
+        'output': report_path_for(input_path, output_dir),
+        'status': 'failed',
+        'rows_in': 0,
+        'rows_out': 0,
+        'stage_timings': {},
+        'run_report': None,
+        'error': None,
+    }
+    report = RunReport(input_path)
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        with report:
+            _run_stages(input_path, result, highlight_style, cache_dir, compact)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    result['stage_timings'] = report.timings()
+    try:
+        result['run_report'] = report.write(result['output'])
+    except OSError as e:
+        print(f"Could not write run report: {e}")
+    return result
+
+def _run_stages(input_path, result, highlight_style, cache_dir, compact):
+    trimmer.default_ruleset.refresh() # This process's own copy of the rules; a bad rule fails before parsing
+    converted_df = file_reader.convert_mhtml_to_dataframe(input_path, cache_dir=cache_dir, compact=compact,
+                                                          numeric_workers=1)
+    if converted_df is None:
+        result['error'] = "conversion failed"
+        return
+    result['rows_in'] = file_reader.body_row_count(converted_df)
+
+    # Remove the stale report so the writer starts a fresh workbook
+    if os.path.exists(result['output']):
+        os.remove(result['output'])
+
+    classification = trimmer.apply_conditional_formatting(
+        converted_df, result['output'], task='both', highlight_style=highlight_style)
+    if classification is None:
+        result['error'] = "classification or report writing failed"
+        return
+    result['rows_out'] = result['rows_in'] - int(classification.remove.iloc[1:].sum()) # Row 0 is the sub-header row
+    result['status'] = 'done'
+
+def run_export_to_pipe(conn, input_path, output_dir, highlight_style='fill', compact=False):
+    """
+    Child-process entry point: runs process_export and sends its result dict through conn.
+    Ctrl-C reaches every process in the group; the child ignores it so the parent can drain.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        conn.send(process_export(input_path, output_dir, highlight_style=highlight_style, compact=compact))
+    finally:
+        conn.close()
@@ -0,0 +1,18 @@
+# --- Progress reporting ---
+# Long-running steps accept an optional progress_callback(percent) that is called with an int 0-100.
+# A callback may raise OperationCancelled to stop the step; callers let it propagate.
+
+class OperationCancelled(Exception):
+    """Raised from a progress callback to abandon the running operation."""
+
+def report_progress(progress_callback, percent):
+    if progress_callback is not None:
+        progress_callback(int(min(100, max(0, percent))))
+
+def scaled_progress(progress_callback, start, end):
+    """
+    Maps a sub-step's 0-100 onto start-end of the caller's range (None stays None).
+    """
+    if progress_callback is None:
+        return None
+    return lambda percent: report_progress(progress_callback, start + (end - start) * percent / 100)
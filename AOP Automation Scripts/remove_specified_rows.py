@@ -1,287 +1,566 @@
 import pandas as pd
-from openpyxl import load_workbook # Not strictly needed for writing new, but good to know
 from openpyxl import Workbook
 from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.styles import Font, PatternFill, Border, Side, Alignment
 from openpyxl.styles.numbers import FORMAT_CURRENCY_USD_SIMPLE, FORMAT_NUMBER_COMMA_SEPARATED1
-from openpyxl.formatting.rule import CellIsRule
+from openpyxl.formatting.rule import CellIsRule, FormulaRule
 from openpyxl.utils import get_column_letter
 import xlsxwriter
 import re # For case-insensitive "test" matching
 import os
-import json
+import contextlib
+import shutil
+import threading
 import numpy as np
+from progress import OperationCancelled, report_progress, scaled_progress
+from instrumentation import stage, instrumented
 
-with open("AOP Automation Scripts/input_data/keyword_groups.json", "r", encoding="utf-8") as f:
-    loaded = json.load(f)
-    red_keywords_group = loaded["red"]
-    red_keywords_complex = loaded["red_complex"]
-    green_keywords_group = loaded["green"]
-    green_keywords_complex = loaded["green_complex"]
+from keyword_config import KEYWORD_GROUPS_PATH, keyword_file_stamp, keyword_groups_digest, load_keyword_groups
+from SAP_File_Automation import SUB_HEADERS_ATTR
+from rollup import RollupCube, build_rollup, rollup_path_for, sub_headers
 
 
 #red_keywords_group = ["MEMORY", "SIP", "FPS", "Molded MEMS", "3O "] # Case-sensitive as per examples
 #green_keywords_group = ["CABGA", "BGA", "SCSP"]              # Case-sensitive
 #green_keywords_complex = ["CA "]
 
-def highlight_rows(column_name : str, df : pd.DataFrame):
-    
-    # Define keywords for red highlighting
-
-    # Define fills
-    red_fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid") # Light Red
-    yellow_fill = PatternFill(start_color="FFFFCC", end_color="FFFFCC", fill_type="solid") # Light Yellow
-    green_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid") # Light Green
-
-
-    # --- Logic to determine cell colors ---
-    # We'll store color instructions: (row_index, col_index, fill_object)
-    cell_formats_to_apply = []
-    remove_activated = False
-    plant_col_idx = df.columns.get_loc(column_name) + 1 # 1-based index for openpyxl
-
-    for r_idx, row in df.iterrows():
-        # openpyxl rows are 1-based, and ExcelWriter usually writes headers, so add 2
-        # (1 for 1-based, 1 for header row)
-        excel_row_num = r_idx + 2
-
-        if excel_row_num == 695:
-            pass
-
-        current_row_override = False
-        cell_value_plant = str(row[column_name]) # Ensure it's a string
-
-        # --- Rule 1 & 2: Red Highlighting for whole row based on 'Plant' column ---
-        is_red = any(re.search(keyword, cell_value_plant, re.IGNORECASE) for keyword in red_keywords_group)
-        is_green = any(re.search(keyword, cell_value_plant, re.IGNORECASE) for keyword in green_keywords_group)
-        
-        #RED Rule
-        if is_red:
-            remove_activated = True
-            current_row_override = True
-            for c_idx in range(1, len(df.columns) + 1): # Apply to all cells in the row
-                cell_formats_to_apply.append({'row': excel_row_num, 'column': c_idx, 'fill': red_fill, 'overwrite_previous_for_cell': True})
-
-        #Green Rule
-        elif is_green:
-            remove_activated = False
-            current_row_override = True
-            for c_idx in range(1, len(df.columns) + 1):
-                cell_formats_to_apply.append({'row': excel_row_num, 'column': c_idx, 'fill': green_fill})
-
-        if re.search(r'test', cell_value_plant, re.IGNORECASE):
-            if remove_activated and not current_row_override:
-                for c_idx in range(1, len(df.columns) + 1):
-                    cell_formats_to_apply.append({'row': excel_row_num, 'column': c_idx, 'fill': yellow_fill})
-            elif not remove_activated:
-                for c_idx in range(1, len(df.columns) + 1):
-                    cell_formats_to_apply.append({'row': excel_row_num, 'column': c_idx, 'fill': green_fill})
-            # Override for specific test use cases 
-            if any(re.search(keyword, str(row['Unnamed: 3']), re.IGNORECASE) for keyword in green_keywords_complex):
-                for c_idx in range(1, len(df.columns) + 1): # Apply to all cells in the row
-                    cell_formats_to_apply.append({'row': excel_row_num, 'column': c_idx, 'fill': green_fill})
-            if any(re.search(keyword, str(row['Unnamed: 3']), re.IGNORECASE) for keyword in red_keywords_complex):
-                for c_idx in range(1, len(df.columns) + 1): # Apply to all cells in the row
-                    cell_formats_to_apply.append({'row': excel_row_num, 'column': c_idx, 'fill': red_fill, 'overwrite_previous_for_cell': True})
-
-    return cell_formats_to_apply, df
-
-def remove_rows(column_name : str, df : pd.DataFrame):
-
-    # Define fills
-    red_fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid") # Light Red
-    yellow_fill = PatternFill(start_color="FFFFCC", end_color="FFFFCC", fill_type="solid") # Light Yellow
-    green_fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid") # Light Green
-
-
-    # --- Logic to determine cell colors ---
-    # We'll store color instructions: (row_index, col_index, fill_object)
-    remove_activated = False
-    remove_index = []
-
-    for r_idx, row in df.iterrows():
-        # openpyxl rows are 1-based, and ExcelWriter usually writes headers, so add 2
-        # (1 for 1-based, 1 for header row)
-        excel_row_num = r_idx + 2
-        current_row_override = False
-        cell_value_plant = str(row[column_name]) # Ensure it's a string
-
-        # --- Rule 1 & 2: Red Highlighting for whole row based on 'Plant' column ---
-        is_red = any(re.search(keyword, cell_value_plant, re.IGNORECASE) for keyword in red_keywords_group)
-        is_green = any(re.search(keyword, cell_value_plant, re.IGNORECASE) for keyword in green_keywords_group)
-            
-        if is_red:
-            remove_activated = True
-            current_row_override = True
-            remove_index.append(r_idx)
-
-        elif is_green:
-            remove_activated = False
-            current_row_override = True
+# --- Keyword matching ---
+MATCH_MEMO_LIMIT = 200000 # Distinct cell strings remembered per matcher before the memo is reset
+
+class KeywordMatcher:
+    """
+    Matches several named keyword groups against a cell with one compiled regex.
+    Keywords keep their re.search semantics (case-insensitive regex, match anywhere).
+    """
+    def __init__(self, keyword_groups : dict):
+        self.all_group_names = list(keyword_groups)
+        self.group_names = [name for name, keywords in keyword_groups.items() if keywords]
+        self._alternations = {name: '|'.join(f'(?:{keyword})' for keyword in keyword_groups[name])
+                              for name in self.group_names}
+        self._patterns = {}
+        self._memo = {} # text -> frozenset of group names, kept for the life of the matcher
+        self._pattern_for(frozenset(self.group_names)) # Compile up front so bad rules fail early
+
+    def _pattern_for(self, names : frozenset):
+        pattern = self._patterns.get(names)
+        if pattern is None:
+            pattern = re.compile('|'.join(f'(?P<{name}>{self._alternations[name]})'
+                                          for name in self.group_names if name in names), re.IGNORECASE)
+            self._patterns[names] = pattern
+        return pattern
+
+    def groups_in(self, text : str) -> set:
+        """
+        Returns the names of every group with a keyword somewhere in `text`. A cell with
+        no hits costs one scan; each hit group is dropped from the next scan.
+        """
+        found = set()
+        remaining = frozenset(self.group_names)
+        while remaining:
+            match = self._pattern_for(remaining).search(text)
+            if match is None:
+                break
+            found.add(match.lastgroup)
+            remaining = remaining - {match.lastgroup}
+        return found
+
+    def group_masks(self, texts : pd.Series) -> dict:
+        """
+        Matches a whole column. Returns {group name: boolean numpy array}, one entry per group
+        given to the constructor (all False for groups without keywords).
+
+        Exports repeat a few thousand Plant/PDL strings over many rows, so the column is
+        factorized and only its unique values are matched; verdicts are broadcast back by code.
+        Verdicts are memoised on the matcher, so later runs with the same rules reuse them.
+        A categorical column (compact mode) is matched on its categories and broadcast by its codes.
+        """
+        if isinstance(texts.dtype, pd.CategoricalDtype):
+            codes, uniques = texts.cat.codes.to_numpy(), texts.cat.categories
+        else:
+            codes, uniques = pd.factorize(texts)
+        unique_hits = [self._memoised_groups_in(text) for text in uniques]
+        masks = {}
+        for name in self.all_group_names:
+            unique_mask = np.fromiter((name in hits for hits in unique_hits), dtype=bool, count=len(unique_hits))
+            masks[name] = np.append(unique_mask, False)[codes] # Code -1 (missing) maps to the trailing False
+        return masks
+
+    def _memoised_groups_in(self, text : str) -> frozenset:
+        hits = self._memo.get(text)
+        if hits is None:
+            if len(self._memo) >= MATCH_MEMO_LIMIT:
+                self._memo.clear()
+            hits = self._memo[text] = frozenset(self.groups_in(text))
+        return hits
+
+class Ruleset:
+    """
+    The keyword groups of a rules file compiled into (plant_matcher, pdl_matcher).
+    Before each use the file's mtime/size is checked; only when that changed is it re-read, and the
+    matchers are only recompiled when the rules themselves differ. Long-running processes (the GUI,
+    the watcher) therefore pick up rules saved from the Advanced Settings tab on their next run.
+    """
+    def __init__(self, path=KEYWORD_GROUPS_PATH):
+        self.path = path
+        self.digest = None # keyword_groups_digest of the compiled rules
+        self._stamp = None
+        self._matchers = None
+        self._lock = threading.Lock() # Serialises refresh() so stamp, digest and matchers change together (the watcher refreshes from two threads)
+
+    def refresh(self) -> bool:
+        """
+        Recompiles if the rules file changed. Returns True if the matchers were (re)built.
+        """
+        with self._lock:
+            stamp = keyword_file_stamp(self.path)
+            if self._matchers is not None and stamp == self._stamp:
+                return False
+            groups = load_keyword_groups(self.path)
+            digest = keyword_groups_digest(groups)
+            if digest == self.digest:
+                self._stamp = stamp
+                return False # Touched or re-saved, same rules: keep the matchers and their memo
+            plant_matcher = KeywordMatcher({'red': groups['red'], 'green': groups['green'], 'test': [r'test']})
+            pdl_matcher = KeywordMatcher({'red_complex': groups['red_complex'], 'green_complex': groups['green_complex']})
+            self._matchers = (plant_matcher, pdl_matcher)
+            self._stamp = stamp # Only once compiled, so a bad rule is reported again on the next run
+            self.digest = digest
+            return True
+
+    def matchers(self):
+        """
+        Returns (plant_matcher, pdl_matcher) for the current rules.
+        The Plant column is checked for the red/green groups and 'test'; PDL for the complex groups.
+        """
+        self.refresh()
+        return self._matchers
+
+default_ruleset = Ruleset()
+
+def get_keyword_matchers():
+    """
+    Returns (plant_matcher, pdl_matcher) for keyword_groups.json (see Ruleset).
+    """
+    return default_ruleset.matchers()
+
+class RowClassification:
+    """
+    Per-row result of classify_rows, computed once and shared by the highlight and remove outputs.
+    `verdicts` is indexed like the classified frame, with columns:
+        color  - highlight fill: 'red', 'yellow', 'green' or ''
+        rule   - the rule that decided the row (see ROW_RULES), '' if none fired
+        remove - True if the row is dropped from the trimmed sheet
+        test   - True if the Plant column matched 'test'
+    `sheets_written` lists the report sheets apply_conditional_formatting wrote from it.
+    """
+    def __init__(self, verdicts : pd.DataFrame):
+        self.verdicts = verdicts
+        self.sheets_written = []
+
+    @property
+    def color(self) -> pd.Series:
+        return self.verdicts['color']
+
+    @property
+    def rule(self) -> pd.Series:
+        return self.verdicts['rule']
+
+    @property
+    def remove(self) -> pd.Series:
+        return self.verdicts['remove']
+
+    def verdict(self) -> np.ndarray:
+        """
+        Per-row 'removed', 'kept_test' (a test row the trimmed sheet keeps) or 'kept', for the rollup cube.
+        """
+        return np.where(self.verdicts['remove'].to_numpy(), 'removed',
+                        np.where(self.verdicts['test'].to_numpy(), 'kept_test', 'kept'))
+
+    def remove_index(self) -> list:
+        """Index labels of the rows to remove, last row first (the order remove_rows returns)."""
+        return self.verdicts.index[self.verdicts['remove'].to_numpy()][::-1].tolist()
+
+    def summary(self) -> str:
+        colors = self.verdicts['color'].value_counts()
+        return (f"Classified {len(self.verdicts)} rows: {colors.get('red', 0)} red, {colors.get('yellow', 0)} yellow, "
+                f"{colors.get('green', 0)} green; {int(self.verdicts['remove'].sum())} to remove.")
+
+# Rule names reported in RowClassification.rule
+ROW_RULES = ['red', 'red_complex', 'green', 'green_complex', 'test_after_red', 'test_after_green']
+
+def as_text(column : pd.Series) -> pd.Series:
+    """
+    The column as strings for matching. Categoricals (compact mode) already hold strings and are matched by code.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column
+    return column.astype(str)
+
+def classify_rows(column_name : str, df : pd.DataFrame, pdl_column : str = 'Unnamed: 3') -> RowClassification:
+    """
+    Applies the red/green/test rules to every row at once.
+
+    A red Plant keyword turns "remove" mode on, a green one turns it off, and the mode carries
+    forward to the rows below (forward fill). A 'test' row with remove mode on is yellow in the
+    highlight and removed from the trimmed sheet, unless its PDL matches a complex keyword.
+    Returns a RowClassification.
+    """
+    plant_matcher, pdl_matcher = get_keyword_matchers()
+    plant_hits = plant_matcher.group_masks(as_text(df[column_name]))
+    is_red, is_green, is_test = plant_hits['red'], plant_hits['green'], plant_hits['test']
+
+    # Remove mode after each row: set by red rows, cleared by green rows, carried forward otherwise
+    remove_activated = (pd.Series(np.where(is_red, 1.0, np.where(is_green, 0.0, np.nan)))
+                        .ffill().fillna(0.0).to_numpy(dtype=bool))
+
+    # The complex (PDL) keywords only matter on test rows
+    is_red_complex = np.zeros(len(df), dtype=bool)
+    is_green_complex = np.zeros(len(df), dtype=bool)
+    if is_test.any():
+        pdl_hits = pdl_matcher.group_masks(as_text(df[pdl_column][is_test]))
+        is_red_complex[is_test] = pdl_hits['red_complex']
+        is_green_complex[is_test] = pdl_hits['green_complex']
+
+    # Red fills overwrite anything; otherwise the first fill given to the row wins
+    color = np.select(
+        [is_red | (is_test & is_red_complex), is_green, is_test & remove_activated, is_test],
+        ['red', 'green', 'yellow', 'green'],
+        default='')
+    remove = is_red | (~is_green & is_test & remove_activated & ~(is_green_complex | is_red_complex))
+    rule = np.select(
+        [is_red, is_test & is_red_complex, is_green, is_test & remove_activated & is_green_complex,
+         is_test & remove_activated, is_test],
+        ROW_RULES,
+        default='')
+
+    return RowClassification(pd.DataFrame({'color': color, 'rule': rule, 'remove': remove, 'test': is_test}, index=df.index))
+
+# Row fills, created once and shared by every highlighted row
+ROW_FILLS = {
+    'red': PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid"), # Light Red
+    'yellow': PatternFill(start_color="FFFFCC", end_color="FFFFCC", fill_type="solid"), # Light Yellow
+    'green': PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid"), # Light Green
+}
+
+@instrumented('highlight')
+def highlight_rows(column_name : str, df : pd.DataFrame, classification : RowClassification = None):
+    """
+    Returns ({excel_row_num: fill}, df): the final fill of every highlighted row.
+    Overlapping rules are already resolved by the classification, so each row gets one fill.
+    """
+    if classification is None:
+        classification = classify_rows(column_name, df)
+
+    # openpyxl rows are 1-based, and ExcelWriter usually writes headers, so add 2
+    # (1 for 1-based, 1 for header row)
+    row_fills_to_apply = {}
+    for row_pos, color in enumerate(classification.color.to_numpy()):
+        if color:
+            row_fills_to_apply[row_pos + 2] = ROW_FILLS[color]
+
+    return row_fills_to_apply, df
+
+PROGRESS_EVERY_ROWS = 5000 # Row-level loops report progress (and can be cancelled) this often
+
+def apply_row_fills(ws, row_fills_to_apply : dict, n_columns : int, progress_callback=None):
+    """
+    Fills whole rows of a worksheet that is still open in the writer (no reload/save round trip).
+    """
+    n_rows = len(row_fills_to_apply)
+    for done, (excel_row_num, fill) in enumerate(row_fills_to_apply.items(), 1):
+        for row_cells in ws.iter_rows(min_row=excel_row_num, max_row=excel_row_num, max_col=n_columns):
+            for cell in row_cells:
+                cell.fill = fill
+        if done % PROGRESS_EVERY_ROWS == 0:
+            report_progress(progress_callback, 100 * done / n_rows)
+    report_progress(progress_callback, 100)
+
+HIGHLIGHT_CLASS_COLUMN = 'Row Color' # Hidden column driving the conditional-formatting rules
+
+def apply_row_rules(ws, n_rows : int, n_columns : int):
+    """
+    Rule-based alternative to apply_row_fills. Expects the row colors in a hidden last column
+    (HIGHLIGHT_CLASS_COLUMN) and adds one conditional-formatting rule per color over the data,
+    so the style work no longer grows with the number of highlighted rows.
+    """
+    class_letter = get_column_letter(n_columns + 1)
+    ws.column_dimensions[class_letter].hidden = True
+    data_range = f"A2:{get_column_letter(n_columns)}{n_rows + 1}"
+    for color, fill in ROW_FILLS.items():
+        ws.conditional_formatting.add(data_range, FormulaRule(formula=[f'${class_letter}2="{color}"'], fill=fill))
+
+@contextlib.contextmanager
+def open_report_writer(output_excel_path, replace_sheets=()):
+    """
+    Opens the output workbook for writing, as a context manager. If it already exists, the sheets
+    named in replace_sheets are cleared in place (same tab position) so they can be written in
+    several chunks. The workbook is written to a temporary copy that only replaces the report
+    once the block completes, so a cancelled or failed write leaves the previous report intact.
+    """
+    root, ext = os.path.splitext(output_excel_path)
+    tmp_path = f"{root}.{os.getpid()}.tmp{ext}"
+    try:
+        if os.path.exists(output_excel_path):
+            shutil.copyfile(output_excel_path, tmp_path)
+            writer = pd.ExcelWriter(tmp_path, engine='openpyxl', mode='a', if_sheet_exists='overlay')
+            for name in replace_sheets:
+                if name in writer.book.sheetnames:
+                    position = writer.book.index(writer.book[name])
+                    del writer.book[name]
+                    writer.book.create_sheet(name, position)
         else:
-            if re.search(r'test', cell_value_plant, re.IGNORECASE):
-                if remove_activated and not current_row_override:
-                    remove_index.append(r_idx)
-                elif not remove_activated:
-                    pass
-                elif current_row_override:
-                    print(f"ERROR! Override in the Test on row {excel_row_num}")
-            if any(re.search(keyword, str(row['Unnamed: 3']), re.IGNORECASE) for keyword in green_keywords_complex):
-                if r_idx in remove_index: 
-                    remove_index.remove(r_idx)
-            if any(re.search(keyword, str(row['Unnamed: 3']), re.IGNORECASE) for keyword in red_keywords_complex):
-                if r_idx in remove_index: 
-                    remove_index.remove(r_idx)
-
-    #Flip the remove index and then remove unecessary rows from Dataframe                 
-    remove_index.reverse()
+            writer = pd.ExcelWriter(tmp_path, engine='openpyxl', mode='w')
+        try:
+            yield writer
+        finally:
+            writer.close()
+        os.replace(tmp_path, output_excel_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def write_frame(writer, df : pd.DataFrame, sheet_name : str, progress_callback=None):
+    """
+    df.to_excel(writer, sheet_name, index=False), written PROGRESS_EVERY_ROWS rows at a time
+    when progress is being reported.
+    """
+    n_rows = len(df)
+    if progress_callback is None or n_rows <= PROGRESS_EVERY_ROWS:
+        df.to_excel(writer, sheet_name=sheet_name, index=False)
+    else:
+        for start in range(0, n_rows, PROGRESS_EVERY_ROWS):
+            chunk = df.iloc[start:start + PROGRESS_EVERY_ROWS]
+            if start == 0:
+                chunk.to_excel(writer, sheet_name=sheet_name, index=False)
+            else:
+                chunk.to_excel(writer, sheet_name=sheet_name, index=False, header=False, startrow=start + 1)
+            report_progress(progress_callback, 100 * (start + len(chunk)) / n_rows)
+    if SUB_HEADERS_ATTR in df.attrs and n_rows:
+        # Converted frames hold NaN in row 0 of their numeric columns; put the sub-headers back
+        ws = writer.sheets[sheet_name]
+        for position, (value, header) in enumerate(zip(df.iloc[0].tolist(), sub_headers(df))):
+            if not isinstance(value, str) and pd.isna(value):
+                ws.cell(row=2, column=position + 1).value = header
+    report_progress(progress_callback, 100)
+
+@instrumented('remove')
+def remove_rows(column_name : str, df : pd.DataFrame, classification : RowClassification = None):
+
+    if classification is None:
+        classification = classify_rows(column_name, df)
+
+    # Remove index comes back flipped (last row first), then remove unecessary rows from Dataframe
+    remove_index = classification.remove_index()
     df = df.drop(index=remove_index)#.reset_index(drop=True)
 
     return remove_index, df 
 
 def modify_headers(df : pd.DataFrame) -> pd.DataFrame:
-    df.columns = [''.join(col.split(' ')[0]) for col in df.columns]
-    column_names = []
-    for i in range(df.shape[1]):
-        column_names.append(df.columns[i] + " " + df.iloc[0, i])
-    df.columns = column_names
-    
-    return df.drop(index=0)
+    """
+    Replaces the two header rows of the 'remove' sheet with one: ' Legal Name', 'JUN Demand', ...
+    Frames from the parser carry these in their SAP layout (report_headers); Excel input is
+    relabelled from its band and sub-header rows.
+    """
+    layout = df.attrs.get('sap_layout')
+    if layout is not None and len(layout['report_headers']) == df.shape[1]:
+        df.columns = layout['report_headers']
+    else:
+        row_0 = sub_headers(df)
+        df.columns = [col.split(' ')[0] + " " + row_0[i] for i, col in enumerate(df.columns)]
+
+    df = df.drop(index=0)
+    df.attrs.pop(SUB_HEADERS_ATTR, None) # Row 0 is gone
+    return df
     
     
-def pivot_table(df : pd.DataFrame, output_filename : str):
-    df.iloc[:, 4:] = df.iloc[:, 4:].apply(pd.to_numeric, errors='coerce').fillna(0)
-    aggregate_vals = [col for col in df.columns[4:] if pd.api.types.is_numeric_dtype(df[col])]
-
-    pivot_table = pd.pivot_table(
-        df, 
-        values = 'JUN Demand',
-        index=' Legal Name',
-        aggfunc='sum'
-    )
-    try:
-        writer = pd.ExcelWriter(output_filename, engine='openpyxl', mode='a', if_sheet_exists='replace')
-        pivot_table.to_excel(writer, sheet_name='Pivot Table', index=True)
-        print('Successful pivot table')
-
-    except ImportError:
-        print("openpyxl is not installed. Styling cannot be applied this way.")
-        print("Please install it: pip install openpyxl pandas")
-        # Fallback to basic Excel writing without advanced styling (Pandas default if openpyxl not specified as engine)
-        with pd.ExcelWriter(output_filename) as writer: # engine defaults to openpyxl if available
-            df.to_excel(writer, sheet_name='Pivot Table', index=True)
-        print(f"\nExcel file '{output_filename}' created successfully (basic).")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-
-
-
-def apply_conditional_formatting(input_excel_path, output_excel_path, task='remove', column_name="Unnamed: 2", sheet_name="Sheet1"):
-    try:
-        df = pd.read_excel(input_excel_path, sheet_name=sheet_name, keep_default_na=False)
-    except FileNotFoundError:
-        print(f"Error: Input file '{input_excel_path}' not found.")
-        return
-    except Exception as e:
-        print(f"Error reading Excel file: {e}")
-        return
+# --- Pivot ---
+PIVOT_SHEET = 'Pivot Table'
+CURRENT_MONTH_FILL = PatternFill(start_color="DDEBF7", end_color="DDEBF7", fill_type="solid") # Light Blue
+
+def write_pivot(writer, pivot : pd.DataFrame, current_month_labels=(), sheet_name=PIVOT_SHEET):
+    """
+    Writes a pivot view to a sheet of an open writer, with the current month's headers shaded.
+    """
+    pivot.to_excel(writer, sheet_name=sheet_name, index=True)
+    ws = writer.sheets[sheet_name]
+    n_levels = pivot.index.nlevels
+    for position, label in enumerate(pivot.columns):
+        if label in current_month_labels:
+            ws.cell(row=1, column=n_levels + position + 1).fill = CURRENT_MONTH_FILL
+
+
+def apply_conditional_formatting(input_excel_path, output_excel_path, task='remove', column_name="Unnamed: 2", sheet_name="Sheet1",
+                                 highlight_style='fill', pivot_levels=('Legal Name',), views=None, progress_callback=None):
+    """
+    Classifies the converted export and writes the 'highlight' and/or 'remove' sheets (task is
+    'highlight', 'remove' or 'both'). highlight_style='fill' colors the highlighted rows directly;
+    'rules' writes a hidden color column plus a few conditional-formatting rules instead, which
+    keeps very large reports small and quick to open.
+    input_excel_path may also be the DataFrame from SAP_File_Automation.convert_mhtml_to_dataframe,
+    which skips the Excel round trip. With the 'remove' sheet a pivot of the kept rows by
+    pivot_levels (see rollup.CUBE_LEVELS) is written too, and the rollup cube it comes from is
+    cached next to the report for configure_report. views (e.g. REPORT_VIEWS) adds configure_report's
+    summary sheets in the same writer session, which saves reopening the finished report for them;
+    like the pivot they are skipped if the rollup fails.
+    Returns the RowClassification, or None if nothing was written.
+    progress_callback(percent) is called as rows are written and styled.
+    """
+    if isinstance(input_excel_path, pd.DataFrame):
+        df = input_excel_path.copy(deep=False)
+    else:
+        try:
+            with stage('read_input', bytes_read=os.path.getsize(input_excel_path)) as read_stage:
+                df = pd.read_excel(input_excel_path, sheet_name=sheet_name, keep_default_na=False)
+                read_stage['rows_out'] = len(df)
+        except FileNotFoundError:
+            print(f"Error: Input file '{input_excel_path}' not found.")
+            return
+        except Exception as e:
+            print(f"Error reading Excel file: {e}")
+            return
 
     if column_name not in df.columns:
         print(f"Error: Column '{column_name}' not found in the sheet.")
         print(f"Available columns are: {df.columns.tolist()}")
         return
 
-    # Determine if file exists
-    file_exists = os.path.exists(output_excel_path)
-        
-
-
+    # Classify once; the highlighted and the trimmed sheets are both derived from this
+    with stage('classify', rows_in=len(df)) as classify_stage:
+        classification = classify_rows(column_name, df)
+        classify_stage['ruleset'] = default_ruleset.digest
+        classify_stage['rows_out'] = len(df) - int(classification.remove.sum())
+    print(classification.summary())
+
+    highlight_df = None
+    remove_df = None
+    cube = pivot = None
+    report_views = {} # sheet name -> view of the cube, see REPORT_VIEWS
     if task == 'both':
         print("Running Both Commands")
-        # Get both DataFrames and formatting instructions
-        remove_index, remove_df = remove_rows(column_name, df)
-        remove_df.iloc[0,0:4]=['Date', 'Legal Name', 'Pkg', 'PDL']
-        remove_df.rename(columns={'Unnamed: 0' : ' ', 'Unnamed: 1' : ' ', 'Unnamed: 2' : ' ', 'Unnamed: 3' : ' '}, inplace=True)
-        cell_formats_to_apply, highlight_df = highlight_rows(column_name, df)
+    if task in ('highlight', 'both'):
+        if task == 'highlight': print("running Highlight Command")
+        row_fills_to_apply, highlight_df = highlight_rows(column_name, df, classification)
+    if task in ('remove', 'both'):
+        if task == 'remove': print("running remove command")
+        remove_index, remove_df = remove_rows(column_name, df, classification)
         try:
-            if file_exists:
-                writer = pd.ExcelWriter(output_excel_path, engine='openpyxl', mode='a', if_sheet_exists='replace')
-            else:
-                writer = pd.ExcelWriter(output_excel_path, engine='openpyxl', mode='w')
-            with writer:
-                highlight_df.to_excel(writer, sheet_name='highlight', index=False)
-                remove_df.to_excel(writer, sheet_name='remove', index=False)
-            wb = load_workbook(output_excel_path)
-            ws = wb['highlight']
-            applied_fills = {}
-            for fmt_instruction in cell_formats_to_apply:
-                cell_coord = (fmt_instruction['row'], fmt_instruction['column'])
-                if fmt_instruction.get('overwrite_previous_for_cell') or cell_coord not in applied_fills:
-                    cell = ws.cell(row=fmt_instruction['row'], column=fmt_instruction['column'])
-                    cell.fill = fmt_instruction['fill']
-                    applied_fills[cell_coord] = fmt_instruction['fill']
-            wb.save(output_excel_path)
-            print(f"Successfully wrote both sheets and applied formatting to '{output_excel_path}'")
+            with stage('rollup', rows_in=len(df)) as rollup_stage:
+                cube = build_rollup(df, classification.verdict())
+                rollup_stage['rows_out'] = len(cube.cube)
+            with stage('pivot'):
+                pivot = cube.view(pivot_levels)
+                report_views = {sheet: cube.view(**view_args) for sheet, view_args in (views or {}).items()}
         except Exception as e:
-            print(f"Error writing Excel file or applying styles: {e}")
+            print(f"Error building Pivot Table: {e}")
             import traceback
             traceback.print_exc()
-        return
-
-    if task == 'remove':
-        print("running remove command")
-        remove_index, remove_df = remove_rows(column_name, df)
+            cube = pivot = None
+            report_views = {}
+        for column, label in zip(remove_df.columns[:4], ['Date', 'Legal Name', 'Pkg', 'PDL']):
+            if isinstance(remove_df[column].dtype, pd.CategoricalDtype) and label not in remove_df[column].cat.categories:
+                remove_df[column] = remove_df[column].cat.add_categories([label])
         remove_df.iloc[0,0:4]=['Date', 'Legal Name', 'Pkg', 'PDL']
         remove_df.rename(columns={'Unnamed: 0' : ' ', 'Unnamed: 1' : ' ', 'Unnamed: 2' : ' ', 'Unnamed: 3' : ' '}, inplace=True)
         remove_df = modify_headers(remove_df)
-        wb = load_workbook(output_excel_path)
-        try:
-            if file_exists:
-                writer = pd.ExcelWriter(output_excel_path, engine='openpyxl', mode='a', if_sheet_exists='replace')
-            else:
-                writer = pd.ExcelWriter(output_excel_path, engine='openpyxl', mode='w')
-            with writer:
-                remove_df.to_excel(writer, sheet_name='remove', index=False)
-            print(f"Successfully updated 'remove' sheet in '{output_excel_path}'")
-        except Exception as e:
-            print(f"Error writing Excel file: {e}")
-            import traceback
-            traceback.print_exc()
-
-        try: 
-            pivot_table(remove_df, output_excel_path)
-        except Exception as e:
-            print(f"Error writing Pivot Table: {e}")
-            import traceback
-            traceback.print_exc()
-        wb.save(output_excel_path)
+    if highlight_df is None and remove_df is None:
+        print(f"Error: Unknown task '{task}'. Expected 'highlight', 'remove' or 'both'.")
+        return
+    report_progress(progress_callback, 10)
+
+    # Progress: classification 0-10, sheet writing 10-100 in proportion to rows
+    stage_rows = {}
+    if highlight_df is not None:
+        stage_rows['highlight'] = len(highlight_df)
+        if highlight_style != 'rules':
+            stage_rows['highlight_fills'] = len(row_fills_to_apply) // 2 # Styling a row costs about half a write
+    if remove_df is not None:
+        stage_rows['remove'] = len(remove_df)
+    if pivot is not None:
+        stage_rows[PIVOT_SHEET] = len(pivot)
+    for sheet, view in report_views.items():
+        stage_rows[sheet] = len(view)
+    stage_progress = {}
+    position = 10
+    for part, rows in stage_rows.items():
+        end = position + 90 * rows / max(1, sum(stage_rows.values()))
+        stage_progress[part] = scaled_progress(progress_callback, position, end)
+        position = end
+
+    # Data, fills, the pivot and any views go out in one writer session: no reload/restyle/save round trip
+    try:
+        with stage('write_report', rows_out=sum(len(f) for f in (highlight_df, remove_df) if f is not None),
+                   written_path=output_excel_path), \
+                open_report_writer(output_excel_path,
+                                   replace_sheets=stage_rows.keys() & {'highlight', 'remove', PIVOT_SHEET, *report_views}) as writer:
+            if highlight_df is not None and highlight_style == 'rules':
+                write_frame(writer, highlight_df.assign(**{HIGHLIGHT_CLASS_COLUMN: classification.color.to_numpy()}),
+                            'highlight', stage_progress['highlight'])
+                apply_row_rules(writer.sheets['highlight'], highlight_df.shape[0], highlight_df.shape[1])
+            elif highlight_df is not None:
+                write_frame(writer, highlight_df, 'highlight', stage_progress['highlight'])
+                apply_row_fills(writer.sheets['highlight'], row_fills_to_apply, highlight_df.shape[1],
+                                stage_progress['highlight_fills'])
+            if remove_df is not None:
+                write_frame(writer, remove_df, 'remove', stage_progress['remove'])
+            if pivot is not None:
+                write_pivot(writer, pivot, cube.current_month_labels)
+                report_progress(stage_progress[PIVOT_SHEET], 100)
+            for sheet, view in report_views.items():
+                write_pivot(writer, view, cube.current_month_labels, sheet_name=sheet)
+                report_progress(stage_progress[sheet], 100)
+        written = [name for name, frame in (('highlight', highlight_df), ('remove', remove_df), (PIVOT_SHEET, pivot))
+                   if frame is not None] + list(report_views)
+        print(f"Successfully wrote {written} to '{output_excel_path}'")
+        classification.sheets_written = written
+    except OperationCancelled:
+        raise
+    except Exception as e:
+        print(f"Error writing Excel file or applying styles: {e}")
+        import traceback
+        traceback.print_exc()
+        return
 
-    if task == 'highlight':
-        print("running Highlight Command")
-        cell_formats_to_apply, highlight_df = highlight_rows(column_name, df)
-        try:
-            if file_exists:
-                writer = pd.ExcelWriter(output_excel_path, engine='openpyxl', mode='a', if_sheet_exists='replace')
-            else:
-                writer = pd.ExcelWriter(output_excel_path, engine='openpyxl', mode='w')
-            with writer:
-                highlight_df.to_excel(writer, sheet_name='highlight', index=False)
-            wb = load_workbook(output_excel_path)
-            ws = wb['highlight']
-            applied_fills = {}
-            for fmt_instruction in cell_formats_to_apply:
-                cell_coord = (fmt_instruction['row'], fmt_instruction['column'])
-                if fmt_instruction.get('overwrite_previous_for_cell') or cell_coord not in applied_fills:
-                    cell = ws.cell(row=fmt_instruction['row'], column=fmt_instruction['column'])
-                    cell.fill = fmt_instruction['fill']
-                    applied_fills[cell_coord] = fmt_instruction['fill']
-            wb.save(output_excel_path)
-            print(f"Successfully updated and formatted 'highlight' sheet in '{output_excel_path}'")
-        except Exception as e:
-            print(f"Error writing Excel file or applying styles: {e}")
-            import traceback
-            traceback.print_exc()
+    if cube is not None:
+        cube.save(rollup_path_for(output_excel_path))
+    report_progress(progress_callback, 100)
+    return classification
+
+# --- Report views ---
+# Summary sheets written by configure_report: sheet name -> RollupCube.view arguments
+REPORT_VIEWS = {
+    'By Legal Name': {'levels': ('Legal Name',)},
+    'By Pkg': {'levels': ('Pkg',)},
+    'By PDL': {'levels': ('PDL',)},
+    'By Legal Name excl Test': {'levels': ('Legal Name',), 'verdicts': ('kept',)},
+    'By Verdict': {'levels': ('verdict',), 'verdicts': None},
+}
+
+def configure_report(output_excel_path, cube : RollupCube = None, views=REPORT_VIEWS, progress_callback=None):
+    """
+    Adds one summary sheet per entry of views to an existing report. The sheets are cut from the
+    rollup cube cached by apply_conditional_formatting, so no export rows are read again.
+    Returns the names of the sheets written, or None if there is no cube for the report.
+    """
+    if cube is None:
+        cube = RollupCube.load(rollup_path_for(output_excel_path))
+    if cube is None:
+        print(f"Error: No rollup cube for '{output_excel_path}'. Run Remove Rows first.")
+        return None
+    try:
+        with stage('configure', written_path=output_excel_path), \
+                open_report_writer(output_excel_path, replace_sheets=views.keys()) as writer:
+            for done, (sheet, view_args) in enumerate(views.items(), 1):
+                write_pivot(writer, cube.view(**view_args), cube.current_month_labels, sheet_name=sheet)
+                report_progress(progress_callback, 100 * done / len(views))
+    except OperationCancelled:
+        raise
+    except Exception as e:
+        print(f"Error writing report views: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+    print(f"Successfully wrote {list(views)} to '{output_excel_path}'")
+    return list(views)
 
 
 
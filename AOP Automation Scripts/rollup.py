@@ -0,0 +1,192 @@
+import datetime
+import os
+import pickle
+import re
+
+import numpy as np
+import pandas as pd
+
+from SAP_File_Automation import SUB_HEADERS_ATTR
+
+# --- Configuration ---
+ROLLUP_VERSION = 1 # Bump when the cube layout changes; older cached cubes are then ignored
+ROLLUP_SUFFIX = ".rollup.pkl" # formatted_report.xlsx -> formatted_report.rollup.pkl
+CUBE_LEVELS = {'Legal Name': 1, 'Pkg': 2, 'PDL': 3} # Row level -> column position in the converted frame
+VERDICTS = ['kept', 'kept_test', 'removed'] # See RowClassification.verdict
+KEPT_VERDICTS = ('kept', 'kept_test') # The rows of the trimmed 'remove' sheet
+NON_ADDITIVE_BANDS = ('Weighted Avg.',) # Per-unit prices; a sum of them means nothing, so they are left out
+MONTH_NAMES = ['JAN', 'FEB', 'MAR', 'APR', 'MAY', 'JUN', 'JUL', 'AUG', 'SEP', 'OCT', 'NOV', 'DEC']
+_MONTH_BAND = re.compile(r'([A-Z]{3}) (\d{4})\b') # 'JUN 2025 Unit Starts'
+
+# --- Measure columns ---
+def sub_headers(df : pd.DataFrame) -> list:
+    """
+    Row 0 of a converted frame (the field labels and Demand/Commit sub-headers). Frames from the
+    parser keep the numeric columns' sub-headers in df.attrs, since those columns can't hold text.
+    """
+    row = df.iloc[0].tolist()
+    stored = df.attrs.get(SUB_HEADERS_ATTR)
+    if stored is None:
+        return row
+    return [header if not isinstance(value, str) and pd.isna(value) else value for value, header in zip(row, stored)]
+
+def column_band(column) -> str:
+    return re.sub(r'\.\d+$', '', str(column)) # Drop the '.1' pandas adds to repeated bands
+
+def band_month(band : str):
+    """
+    (year, month) a column band covers: 'AUG 2025 Unit Starts' -> (2025, 8), and for weekly
+    bands the month the ISO week starts in ('22/2025 Unit Starts' -> (2025, 5)). None otherwise.
+    """
+    match = _MONTH_BAND.match(band)
+    if match and match.group(1) in MONTH_NAMES:
+        return int(match.group(2)), MONTH_NAMES.index(match.group(1)) + 1
+    match = re.match(r'(\d{1,2})/(\d{4})\b', band)
+    if match:
+        try:
+            week_start = datetime.date.fromisocalendar(int(match.group(2)), int(match.group(1)), 1)
+        except ValueError:
+            return None
+        return week_start.year, week_start.month
+    return None
+
+def snapshot_month(df : pd.DataFrame):
+    """
+    (year, month) of the export's snapshot date (first column), or of today if it can't be read.
+    """
+    dates = pd.to_datetime(df.iloc[1:, 0], format='%m/%d/%Y', errors='coerce').dropna()
+    if len(dates):
+        return dates.iloc[0].year, dates.iloc[0].month
+    today = datetime.date.today()
+    return today.year, today.month
+
+def measure_labels(df : pd.DataFrame) -> dict:
+    """
+    Maps each measure column (position 4 on) of a converted frame to a unique label made of its
+    band and the Demand/Commit sub-header in row 0, e.g. 'JUN 2025 Unit Starts Demand'.
+    """
+    labels = {}
+    for column, sub_header in zip(df.columns[4:], sub_headers(df)[4:]):
+        band = column_band(column)
+        if band.startswith(NON_ADDITIVE_BANDS):
+            continue
+        labels[column] = f"{band} {sub_header}".strip()
+    return labels
+
+def measure_values(df : pd.DataFrame) -> pd.DataFrame:
+    """
+    The body rows' measure columns as numbers, relabelled with measure_labels. Columns already
+    converted upstream are used as they are; text ones (Excel input) are coerced once.
+    Bands with no numbers at all (the '#' columns) are dropped.
+    """
+    labels = measure_labels(df)
+    values = df.iloc[1:][list(labels)] # Row 0 holds the sub-headers
+    text_columns = [c for c in values.columns if not pd.api.types.is_numeric_dtype(values[c])]
+    if text_columns:
+        values = values.assign(**{c: pd.to_numeric(values[c], errors='coerce') for c in text_columns})
+    narrow_columns = [c for c in values.columns if values[c].dtype != np.float64] # Compact float32: sum in float64
+    if narrow_columns:
+        values = values.astype({c: np.float64 for c in narrow_columns})
+    values = values.loc[:, values.notna().any().to_numpy()]
+    values.columns = [labels[c] for c in values.columns]
+    return values
+
+def is_monthly_band(band : str) -> bool:
+    """
+    True for month bands ('AUG 2025 Unit Starts'), False for weekly ('22/2025 Unit Starts') and other bands.
+    """
+    match = _MONTH_BAND.match(band)
+    return bool(match) and match.group(1) in MONTH_NAMES
+
+def monthly_values(df : pd.DataFrame) -> pd.DataFrame:
+    """
+    measure_values for the month bands only, e.g. 'AUG 2025 Unit Starts Demand'. Blank measures count as 0.
+    Weekly bands are left out: each one repeats the figure of the month it falls in rather than
+    holding a share of it, so they can't be added up into months. Exports taken on different dates
+    therefore line up on the months both of them show as month bands.
+    """
+    labels = measure_labels(df)
+    monthly = {label for column, label in labels.items() if is_monthly_band(column_band(column))}
+    values = measure_values(df).fillna(0)
+    return values[[label for label in values.columns if label in monthly]]
+
+# --- Rollup cube ---
+class RollupCube:
+    """
+    Measure totals of one export pre-aggregated over (Legal Name, Pkg, PDL, verdict), one column
+    per month/measure. Every pivot view of the report is a regroup of this (a few thousand rows
+    at most) instead of another pass over the full export.
+    `current_month_labels` are the measures in the export's snapshot month.
+    """
+    def __init__(self, cube : pd.DataFrame, current_month_labels=()):
+        self.cube = cube
+        self.current_month_labels = list(current_month_labels)
+
+    @property
+    def measures(self) -> list:
+        return list(self.cube.columns)
+
+    def view(self, levels=('Legal Name',), verdicts=KEPT_VERDICTS, measures=None) -> pd.DataFrame:
+        """
+        Totals by `levels` (any of CUBE_LEVELS and 'verdict', outermost first) over the rows with the
+        given verdicts. measures limits the columns (e.g. to current_month_labels); an empty levels
+        gives one 'Total' row.
+        """
+        unknown = [level for level in levels if level not in CUBE_LEVELS and level != 'verdict']
+        if unknown:
+            raise ValueError(f"Unknown level(s) {unknown}; expected some of {list(CUBE_LEVELS) + ['verdict']}")
+        cube = self.cube
+        if verdicts is not None:
+            cube = cube[cube.index.get_level_values('verdict').isin(verdicts)]
+        if measures is not None:
+            cube = cube[[m for m in measures if m in cube.columns]]
+        if not levels:
+            return cube.sum().to_frame('Total').T
+        return cube.groupby(level=list(levels), sort=True, dropna=False, observed=True).sum()
+
+    def save(self, path):
+        """
+        Pickles the cube to path (next to the report, see rollup_path_for). Failures are only reported.
+        """
+        try:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'version': ROLLUP_VERSION, 'cube': self.cube,
+                             'current_month_labels': self.current_month_labels}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Could not cache the rollup cube: {e}")
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns the cube saved at path, or None if there is none (or it is from an older layout).
+        """
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        if not isinstance(data, dict) or data.get('version') != ROLLUP_VERSION:
+            return None
+        return cls(data['cube'], data['current_month_labels'])
+
+def rollup_path_for(output_excel_path):
+    return os.path.splitext(output_excel_path)[0] + ROLLUP_SUFFIX
+
+def build_rollup(df : pd.DataFrame, verdicts) -> RollupCube:
+    """
+    Aggregates a classified converted frame into a RollupCube in one groupby.
+    verdicts holds one entry of VERDICTS per row of df (see RowClassification.verdict).
+    """
+    values = measure_values(df)
+    body = df.iloc[1:]
+    keys = [body.iloc[:, position].rename(level) for level, position in CUBE_LEVELS.items()]
+    keys.append(pd.Series(np.asarray(verdicts)[1:], index=body.index, name='verdict'))
+    cube = values.groupby(keys, sort=True, dropna=False, observed=True).sum() # observed: compact keys are categoricals
+
+    current = snapshot_month(df)
+    labels = measure_labels(df)
+    current_month_labels = [label for column, label in labels.items()
+                            if label in cube.columns and band_month(column_band(column)) == current]
+    return RollupCube(cube, current_month_labels)